@@ -7,15 +7,220 @@
 # the full text of the license.
 
 # update.py: Make changes to an existing bug
-import bugzilla
+import argparse
+import collections
 import fileinput
+import glob
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-# public test instance of bugzilla.redhat.com. It's okay to make changes
-URL = "bugzilla.redhat.com"
-bzapi = bugzilla.Bugzilla(URL)
-if not bzapi.logged_in:
-    print("This example requires cached login credentials for %s" % URL)
-    bzapi.interactive_login()
+import obsolete_packages
+from filing import (CONCURRENCY, TRANSIENT_ERRORS, Campaign, RateLimiter, call_with_retries,
+                    connect, not_processed)
+
+CHUNK = int(os.getenv('CHUNK', 100))  # bugs per update_bugs call
+ROUNDS = int(os.getenv('ROUNDS', 3))  # how many times to resend the failed chunks
+QUERY_CHUNK = int(os.getenv('QUERY_CHUNK', 1000))  # bugs per getbugs call
+
+TARGET = {'status': 'CLOSED', 'resolution': 'RAWHIDE'}
+OPEN = ['NEW', 'ASSIGNED', 'POST', 'MODIFIED', 'ON_QA']
+# components of the packages obsolete_packages.py never indexes, never closed with --tracker
+UNINDEXED = set(obsolete_packages.excludepkgs.split(','))
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--dry-run', action='store_true',
+                    help='only report which bugs would be closed')
+parser.add_argument('--tracker', type=int, action='append', dest='trackers', default=[], metavar='ID',
+                    help='instead of reading bug IDs, close the open bugs blocking this tracker '
+                         'whose components are no longer in rawhide, can be repeated')
+parser.add_argument('--campaign', metavar='SPEC',
+                    help='as --tracker, with the trackers of a filing.py campaign spec')
+parser.add_argument('--cachedir', default=obsolete_packages.DNF_CACHEDIR,
+                    help='where obsolete_packages.py keeps the rawhide index (default: %(default)s)')
+parser.add_argument('--rawhide', type=int, default=obsolete_packages.RAWHIDEVER,
+                    help='the rawhide Fedora version, as given to obsolete_packages.py '
+                         '(default: %(default)s)')
+parser.add_argument('--arch', action='append', dest='arches',
+                    help='the rawhide architecture to look for components in, can be repeated '
+                         '(default: all indexed ones, or %s)' % obsolete_packages.ARCH)
+parser.add_argument('files', nargs='*',
+                    help='files with bug IDs, one per line (default: stdin)')
+args = parser.parse_args()
+if args.campaign:
+    args.trackers += Campaign(args.campaign).trackers
+if args.trackers and args.files:
+    parser.error('bug ID files cannot be combined with --tracker or --campaign')
+obsolete_packages.DNF_CACHEDIR = args.cachedir
+
+# bugzilla.redhat.com, or a fake one, see BUGZILLA_URL and BUGZILLA_BACKEND in filing.py
+bzapi = connect()
+
+
+def read_ids(lines):
+    """Lazily yield bug IDs from lines, skipping blank ones"""
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield int(line)
+
+
+def chunked(iterable, size):
+    """Lazily yield lists of at most size items"""
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def update_chunks(chunks, update, concurrency=CONCURRENCY):
+    """
+    Send the update for every chunk of bug IDs, at most concurrency chunks at a time
+
+    Chunks are read lazily, yields (chunk, exception or None) tuples in order.
+    """
+    limiter = RateLimiter()
+
+    def send(chunk):
+        try:
+            # a retry after a timeout could repeat the comment and its e-mails
+            call_with_retries(bzapi.update_bugs, chunk, update, limiter=limiter,
+                              idempotent=False)
+        except Exception as e:
+            return e
+        return None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        inflight = collections.deque()
+        for chunk in chunks:
+            inflight.append((chunk, executor.submit(send, chunk)))
+            if len(inflight) >= concurrency * 2:
+                chunk, future = inflight.popleft()
+                yield chunk, future.result()
+        for chunk, future in inflight:
+            yield chunk, future.result()
+
+
+def is_closed(bug):
+    """Whether a bug is closed already, with any resolution, it is left as it is then"""
+    return bug.status == TARGET['status']
+
+
+def preflight(bugz):
+    """
+    Fetch the state of all bugs in a few getbugs calls with minimal fields
+
+    Returns a list of bugs that are not closed yet, with any resolution.
+    With --dry-run, reports the state of every bug.
+    """
+    todo = []
+    for chunk in chunked(bugz, QUERY_CHUNK):
+        for bug in bzapi.getbugs(chunk, include_fields=['id', 'status', 'resolution', 'component']):
+            if bug is None:
+                continue  # no such bug, or not accessible
+            done = is_closed(bug)
+            if args.dry_run:
+                action = f'skip, closed as {bug.resolution}' if done else 'close'
+                print(f'{bug.id} {bug.component} {bug.status}: {action}')
+            if not done:
+                todo.append(bug)
+    return todo
+
+
+def rawhide_arches():
+    """The --arch arches, or all those with a rawhide index in --cachedir, or the default one"""
+    if args.arches:
+        return args.arches
+    prefix, suffix = obsolete_packages.index_path(args.rawhide, '*').split('*')
+    arches = sorted(path[len(prefix):-len(suffix)] for path in glob.glob(f'{prefix}*{suffix}'))
+    return [arch for arch in arches if arch != 'noarch'] or [obsolete_packages.ARCH]
+
+
+def retired_bugs(trackers):
+    """
+    Fetch the open bugs blocking the trackers, return those of components gone from rawhide
+
+    Takes one getbugs call for the trackers and one query per QUERY_CHUNK bugs,
+    the rawhide components are read from the obsolete_packages.py indexes of all arches.
+    Components the indexes never contain (see UNINDEXED) are not closed.
+    Refuses to go on without any rawhide components, every bug would be closed.
+    With --dry-run, reports the verdict for every bug.
+    """
+    rawhide = set()
+    arches = rawhide_arches()
+    for arch in arches:
+        rawhide |= {pkg.source for pkg in
+                    obsolete_packages.repoquery(all=True, version=args.rawhide, arch=arch)}
+    if not rawhide:
+        sys.exit(f'No components found in the Fedora {args.rawhide} ({", ".join(arches)}) index '
+                 f'in {args.cachedir}, refusing to close every bug')
+    depends_on = sorted({bug_id
+                         for tracker in bzapi.getbugs(trackers, include_fields=['id', 'depends_on'])
+                         if tracker is not None
+                         for bug_id in tracker.depends_on})
+    todo = []
+    for chunk in chunked(depends_on, QUERY_CHUNK):
+        query = bzapi.build_query(status=OPEN,
+                                  include_fields=['id', 'status', 'resolution', 'component'])
+        query['id'] = chunk
+        for bug in bzapi.query(query):
+            retired = bug.component not in rawhide and bug.component not in UNINDEXED
+            if args.dry_run:
+                if retired:
+                    action = 'close'
+                elif bug.component in UNINDEXED:
+                    action = 'skip, not indexed'
+                else:
+                    action = 'skip, in rawhide'
+                print(f'{bug.id} {bug.component} {bug.status}: {action}')
+            if retired:
+                todo.append(bug)
+    return todo
+
+
+def unclosed(chunk):
+    """The bugs of a chunk that are not closed yet, the chunk itself if that cannot be found out"""
+    try:
+        bugs = call_with_retries(
+            lambda: bzapi.getbugs(chunk, include_fields=['id', 'status', 'resolution']))
+    except TRANSIENT_ERRORS as e:
+        print(f'Cannot check {len(chunk)} bugs {chunk[0]}..{chunk[-1]}: {e}', file=sys.stderr)
+        return None
+    return [bug.id for bug in bugs if bug is not None and not is_closed(bug)]
+
+
+def close(chunks, update):
+    """
+    Send the update for all chunks, report each of them, resend failed ones
+
+    If a chunk failed in a way it might have been updated anyway (e.g. a read timeout),
+    only its bugs that are still not closed are resent.
+    Returns the chunks that failed in the last round, or could not be checked.
+    """
+    failed, unknown = [], []
+    for _ in range(ROUNDS + 1):
+        failed = []
+        for chunk, error in update_chunks(chunks, update):
+            span = f'{len(chunk)} bugs {chunk[0]}..{chunk[-1]}'
+            if error is None:
+                print(f'Updated {span}', file=sys.stderr)
+            else:
+                print(f'Failed to update {span}: {error}', file=sys.stderr)
+                failed.append((chunk, error))
+        chunks = []
+        for chunk, error in failed:
+            if not not_processed(error):
+                rest = unclosed(chunk)
+                if rest is None:
+                    unknown.append(chunk)
+                    continue
+                chunk = rest
+            if chunk:
+                chunks.append(chunk)
+        if not chunks:
+            break
+    return chunks + unknown
 
 
 # Similar to build_query, build_update is a helper function that handles
@@ -27,12 +232,24 @@ if not bzapi.logged_in:
 # Example bug: https://partner-bugzilla.redhat.com/show_bug.cgi?id=427301
 # Don't worry, changing things here is fine, and won't send any email to
 # users or anything. It's what partner-bugzilla.redhat.com is for!
-bugz = [int(line.strip()) for line in fileinput.input() if line]
-
+start = time.monotonic()
+if args.trackers:
+    todo = retired_bugs(args.trackers)
+else:
+    todo = preflight(read_ids(fileinput.input(args.files)))
+print(f'Query phase: {len(todo)} bugs to close, {time.monotonic() - start:.1f} s',
+      file=sys.stderr)
+if args.dry_run:
+    sys.exit(0)
 
-update = bzapi.build_update(comment='Retired in rawhide.', status='CLOSED',
-                            resolution='RAWHIDE')
-bzapi.update_bugs(bugz, update)
+update = bzapi.build_update(comment='Retired in rawhide.', **TARGET)
+start = time.monotonic()
+failed = close(chunked((bug.id for bug in todo), CHUNK), update)
+print(f'Update phase: {time.monotonic() - start:.1f} s', file=sys.stderr)
+for chunk in failed:
+    print('\n'.join(str(bug) for bug in chunk))
+if failed:
+    sys.exit(1)
 
 
 # The 'bug' object actually has some old convenience APIs for specific
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+# fakebz.py: An in-memory stand-in for bugzilla.Bugzilla, for load testing
+#
+# Selected by BUGZILLA_BACKEND=fake, e.g.:
+#
+#   BUGZILLA_BACKEND=fake FAKEBZ_LATENCY=0.3 FAKEBZ_RPS=5 ./create_f32.py
+#   seq 1000 2000 | BUGZILLA_BACKEND=fake FAKEBZ_FAILURES=0.1 ./close.py
+#
+# The fake backend keeps its own journal and tracker cache (*.fake.*, see filing.state_path).
+# The bugs only live as long as the process, unless served over HTTP to python-bugzilla,
+# shared by all the scripts:
+#
+#   ./fakebz.py --port 8080 &
+#   BUGZILLA_URL=http://localhost:8080/xmlrpc.cgi ./create_f32.py
+#
+# Every call waits FAKEBZ_LATENCY seconds plus FAKEBZ_PER_BUG for each bug it touches,
+# calls over FAKEBZ_RPS per second are refused with HTTP 429 and FAKEBZ_FAILURES (a ratio)
+# of calls fail with a refused connection (HTTP 503 when served). FAKEBZ_TIMEOUTS (a ratio) of the createbug and update_bugs
+# calls time out after the change was made, as a slow server would.
+# The throughput of each method is reported at exit.
+# Every bug ID exists, unknown ones are created empty on first access.
+
+import argparse
+import atexit
+import os
+import random
+import sys
+import threading
+import time
+import xmlrpc.client
+from collections import defaultdict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY = float(os.getenv('FAKEBZ_LATENCY', 0))  # seconds
+PER_BUG = float(os.getenv('FAKEBZ_PER_BUG', 0))  # seconds for each bug in a call
+RPS = float(os.getenv('FAKEBZ_RPS', 0))  # 0 means unlimited
+FAILURES = float(os.getenv('FAKEBZ_FAILURES', 0))  # ratio of failing calls
+TIMEOUTS = float(os.getenv('FAKEBZ_TIMEOUTS', 0))  # ratio of changes timing out when done
+SEED = os.getenv('FAKEBZ_SEED')
+
+
+def now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class FakeBug:
+    def __init__(self, bzapi, id, component='distribution', blocks=(), **fields):
+        self.bzapi = bzapi
+        self.id = id
+        self.component = component
+        self.status = 'NEW'
+        self.resolution = ''
+        self.blocks = list(blocks)
+        self.depends_on = []
+        self.comments = []
+        self.last_change_time = now()
+        self.__dict__.update(fields)
+
+    @property
+    def weburl(self):
+        return f'https://{self.bzapi.url}/show_bug.cgi?id={self.id}'
+
+
+class FakeBugzilla:
+    """Implements the subset of bugzilla.Bugzilla used by the scripts"""
+    def __init__(self, url, latency=LATENCY, per_bug=PER_BUG, rps=RPS, failures=FAILURES, timeouts=TIMEOUTS,
+                 seed=SEED):
+        self.url = url
+        self.latency = latency
+        self.per_bug = per_bug
+        self.rps = rps
+        self.failures = failures
+        self.timeouts = timeouts
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.bugs = {}
+        self.next_id = 2_000_000
+        self.window = (0, 0)  # (second, calls served in it)
+        self.calls = defaultdict(int)
+        self.started = time.monotonic()
+        self.logged_in = True
+        atexit.register(self.report)
+
+    def interactive_login(self):
+        pass
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        for method, calls in sorted(self.calls.items()):
+            print(f'fakebz: {method}: {calls} calls, {calls / elapsed:.1f}/s',
+                  file=sys.stderr)
+
+    def _call(self, method, bugs=1):
+        """Simulate the latency, rate limit and failures of a server round-trip"""
+        time.sleep(self.latency + self.per_bug * bugs)
+        with self.lock:
+            self.calls[method] += 1
+            second = int(time.monotonic())
+            served = self.window[1] + 1 if self.window[0] == second else 1
+            self.window = (second, served)
+            if self.rps and served > self.rps:
+                raise xmlrpc.client.ProtocolError(self.url, 429, 'Too Many Requests', {})
+            if self.random.random() < self.failures:
+                raise ConnectionRefusedError(f'{self.url}: simulated failure in {method}')
+
+    def _reply(self, method):
+        """Simulate a response lost after the server made the change"""
+        with self.lock:
+            if self.random.random() < self.timeouts:
+                raise TimeoutError(f'{self.url}: simulated timeout in {method}')
+
+    def _bug(self, bug_id):
+        bug_id = int(bug_id)
+        if bug_id not in self.bugs:
+            self.bugs[bug_id] = FakeBug(self, bug_id)
+        return self.bugs[bug_id]
+
+    # The build_* helpers only assemble dicts, as in python-bugzilla
+
+    def build_createbug(self, **kwargs):
+        return kwargs
+
+    def build_update(self, **kwargs):
+        return kwargs
+
+    def build_query(self, **kwargs):
+        return kwargs
+
+    def createbug(self, createinfo):
+        self._call('createbug')
+        with self.lock:
+            self.next_id += 1
+            bug = FakeBug(self, self.next_id, **createinfo)
+            self.bugs[bug.id] = bug
+            for tracker in bug.blocks:
+                self._bug(tracker).depends_on.append(bug.id)
+        self._reply('createbug')
+        return bug
+
+    def getbug(self, bug_id, include_fields=None):
+        self._call('getbug')
+        with self.lock:
+            return self._bug(bug_id)
+
+    def getbugs(self, bug_ids, include_fields=None):
+        self._call('getbugs', len(bug_ids))
+        with self.lock:
+            return [self._bug(bug_id) for bug_id in bug_ids]
+
+    def update_bugs(self, bug_ids, update):
+        self._call('update_bugs', len(bug_ids))
+        with self.lock:
+            for bug_id in bug_ids:
+                bug = self._bug(bug_id)
+                for field in 'status', 'resolution', 'component':
+                    if field in update:
+                        setattr(bug, field, update[field])
+                if 'comment' in update:
+                    bug.comments.append(update['comment'])
+                bug.last_change_time = now()
+        self._reply('update_bugs')
+        return {}
+
+    def query(self, query):
+        self._call('query', len(query.get('id') or ()) or 1)
+        components = query.get('component')
+        if isinstance(components, str):
+            components = [components]
+        statuses = query.get('status')
+        if isinstance(statuses, str):
+            statuses = [statuses]
+        ids = query.get('id')
+        with self.lock:
+            bugs = [self._bug(bug_id) for bug_id in ids] if ids else list(self.bugs.values())
+        return [bug for bug in bugs
+                if (not components or bug.component in components)
+                and (not statuses or bug.status in statuses)
+                and bug.last_change_time >= query.get('last_change_time', '')]
+
+
+def as_dict(bug):
+    return {field: value for field, value in vars(bug).items() if field != 'bzapi'}
+
+
+class XMLRPCHandler(BaseHTTPRequestHandler):
+    """Serves the Bugzilla XML-RPC methods used by python-bugzilla from a FakeBugzilla"""
+    protocol_version = 'HTTP/1.1'
+
+    def dispatch(self, method, args):
+        bzapi = self.server.bzapi
+        if method == 'Bug.create':
+            return {'id': bzapi.createbug(args).id}
+        if method == 'Bug.get':
+            return {'bugs': [as_dict(bug) for bug in bzapi.getbugs(args['ids'])], 'faults': []}
+        if method == 'Bug.update':
+            ids = args.pop('ids')
+            bzapi.update_bugs(ids, args)
+            return {'bugs': [{'id': bug_id, 'changes': {}} for bug_id in ids]}
+        if method == 'Bug.search':
+            return {'bugs': [as_dict(bug) for bug in bzapi.query(args)]}
+        if method == 'Bugzilla.version':
+            return {'version': '5.0'}
+        if method == 'Bugzilla.extensions':
+            return {'extensions': {}}
+        if method == 'User.login':
+            return {'id': 1, 'token': 'fake'}
+        if method in ('User.get', 'User.logout', 'User.valid_login'):
+            return {'users': []}
+        raise xmlrpc.client.Fault(32000, f'fakebz does not implement {method}')
+
+    def do_POST(self):
+        if self.path != '/xmlrpc.cgi':
+            self.send_error(404)
+            return
+        params, method = xmlrpc.client.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        try:
+            response = xmlrpc.client.dumps((self.dispatch(method, params[0] if params else {}),),
+                                           methodresponse=True, allow_none=True)
+        except xmlrpc.client.ProtocolError as e:
+            self.send_error(e.errcode, e.errmsg)
+            return
+        except ConnectionRefusedError as e:
+            self.send_error(503, str(e))
+            return
+        except TimeoutError:
+            self.close_connection = True  # the change is made, the response is lost
+            return
+        except xmlrpc.client.Fault as fault:
+            response = xmlrpc.client.dumps(fault, allow_none=True)
+        except Exception as e:
+            response = xmlrpc.client.dumps(xmlrpc.client.Fault(32000, str(e)), allow_none=True)
+        body = response.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # one line per call would drown the throughput report
+
+
+def serve(port, host='localhost'):
+    """Serve a FakeBugzilla over XML-RPC at http://host:port/xmlrpc.cgi until interrupted"""
+    server = ThreadingHTTPServer((host, port), XMLRPCHandler)
+    server.bzapi = FakeBugzilla(f'{host}:{port}')
+    print(f'fakebz: serving http://{host}:{port}/xmlrpc.cgi', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serve an in-memory fake Bugzilla over XML-RPC, configured by FAKEBZ_* variables')
+    parser.add_argument('--port', type=int, default=8080,
+                        help='the port to listen on (default: %(default)s)')
+    parser.add_argument('--host', default='localhost',
+                        help='the address to listen on (default: %(default)s)')
+    args = parser.parse_args()
+    serve(args.port, args.host)
@@ -0,0 +1,520 @@
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+# filing.py: A mass bug filing engine driven by campaign spec files
+#
+# Usage: filing.py campaigns/<campaign>.json [--resume] [--journal PATH] [--dry-run PATH]
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+# public test instance of bugzilla.redhat.com.
+#
+# Don't worry, changing things here is fine, and won't send any email to
+# users or anything. It's what partner-bugzilla.redhat.com is for!
+URL = os.getenv('BUGZILLA_URL', 'bugzilla.redhat.com')
+# real: python-bugzilla talking to URL (which can be a local fake server as well),
+# fake: the in-memory fakebz.FakeBugzilla, with simulated latency and failures
+BACKEND = os.getenv('BUGZILLA_BACKEND', 'real')
+
+MAXBUGZ = float(os.getenv('MAXBUGZ', 'inf'))
+CONCURRENCY = int(os.getenv('CONCURRENCY', 4))  # parallel requests
+RATE = float(os.getenv('RATE', 2))  # requests per second, 0 means unlimited
+RETRIES = int(os.getenv('RETRIES', 5))
+TRACKER_CACHE = os.getenv('TRACKER_CACHE', '_tracker_cache.json')
+
+# Connection problems (requests exceptions are OSErrors as well) and HTTP errors
+# are worth retrying, Bugzilla faults (e.g. unknown component) are not
+TRANSIENT_ERRORS = (OSError, xmlrpc.client.ProtocolError)
+# HTTP errors of requests Bugzilla refused to process
+REFUSED_HTTP = (429, 503)
+# (urllib3) exceptions raised before a request is sent
+UNSENT_ERRORS = ('ConnectionRefusedError', 'ConnectTimeout', 'NewConnectionError')
+
+WHITESPACE = re.compile(r'\s*')
+DELIMITERS = frozenset(' \t\n\r,:]}')  # what can follow a complete JSON value
+
+
+def state_path(path, backend=BACKEND):
+    """
+    Where to keep a state file (journal, tracker cache) for the backend
+
+    The fake backend gets its own files, so a load test never marks real components as done.
+    """
+    if backend == 'fake':
+        root, ext = os.path.splitext(path)
+        return f'{root}.fake{ext}'
+    return path
+
+
+def connect(url=URL, backend=BACKEND):
+    """Connect to Bugzilla, log in interactively if there are no cached credentials"""
+    if backend == 'fake':
+        import fakebz
+        bzapi = fakebz.FakeBugzilla(url)
+    elif backend == 'real':
+        import bugzilla
+        bzapi = bugzilla.Bugzilla(url)
+    else:
+        raise ValueError(f'unknown BUGZILLA_BACKEND {backend!r}, use real or fake')
+    if not bzapi.logged_in:
+        print("This example requires cached login credentials for %s" % url)
+        bzapi.interactive_login()
+    return bzapi
+
+
+class RateLimiter:
+    """Lets at most rate calls per second through, shared by all threads"""
+    def __init__(self, rate=RATE):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next - now
+            self.next = max(now, self.next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def not_processed(error):
+    """
+    Whether an error proves the request was not processed by Bugzilla
+
+    That is, it was refused (429, 503) or never sent (connection refused or timed out).
+    A read timeout or a dropped connection might come after the request was processed.
+    """
+    if isinstance(error, xmlrpc.client.ProtocolError):
+        return error.errcode in REFUSED_HTTP
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if type(error).__name__ in UNSENT_ERRORS:
+            return True
+        # requests and urllib3 keep the underlying error in the chain or in .reason
+        error = error.__cause__ or error.__context__ or getattr(error, 'reason', None)
+        if not isinstance(error, BaseException):
+            return False
+    return False
+
+
+def call_with_retries(func, *args, limiter=None, retries=RETRIES, idempotent=True):
+    """
+    Call func(*args), retry with exponential backoff on transient errors
+
+    If a limiter is given, every attempt waits for it first.
+    Calls that are not idempotent (e.g. createbug) are only retried
+    when the error proves the previous attempt was not processed.
+    """
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.wait()
+        try:
+            return func(*args)
+        except TRANSIENT_ERRORS as e:
+            if attempt == retries or not (idempotent or not_processed(e)):
+                raise
+            delay = 2 ** attempt
+            print(f'{e}, retrying in {delay} s', file=sys.stderr)
+            time.sleep(delay)
+
+
+def iter_json_object(path, chunk_size=1 << 16):
+    """
+    Yield (key, value) pairs of a top-level JSON object without loading the whole file
+
+    Only the value being decoded and one chunk of the file are kept in memory.
+    """
+    decoder = json.JSONDecoder()
+    with open(path) as f:
+        buf, pos, eof = '', 0, False
+
+        def fill():
+            nonlocal buf, pos, eof
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+
+        def skip_whitespace():
+            nonlocal pos
+            while True:
+                pos = WHITESPACE.match(buf, pos).end()
+                if pos < len(buf) or eof:
+                    return
+                fill()
+
+        def char():
+            nonlocal pos
+            skip_whitespace()
+            pos += 1
+            return buf[pos-1:pos]
+
+        def value():
+            nonlocal pos
+            skip_whitespace()
+            while True:
+                try:
+                    obj, end = decoder.raw_decode(buf, pos)
+                    # a value not followed by a delimiter (e.g. 12 of 12.5) might continue
+                    if eof or end < len(buf) and buf[end] in DELIMITERS:
+                        pos = end
+                        return obj
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+        if char() != '{':
+            raise ValueError(f'{path} does not contain a JSON object')
+        skip_whitespace()
+        if buf[pos:pos+1] == '}':
+            return
+        while True:
+            key = value()
+            if char() != ':':
+                raise ValueError(f'{path}: expected : after {key!r}')
+            yield key, value()
+            separator = char()
+            if separator == '}':
+                return
+            if separator != ',':
+                raise ValueError(f'{path}: expected , or }} after {key!r}')
+
+
+def portingdb_components(path):
+    """
+    Group the subpackages marked drop_now in portingdb results by their source, in one pass
+
+    Returns a dict:
+      keys: components (source package names)
+      values: (source_verdict, sorted list of subpackages) tuples,
+              the source_verdict is the one of the alphabetically first subpackage
+    """
+    components = {}
+    for name, result in iter_json_object(path):
+        if result['verdict'] != 'drop_now':
+            continue
+        first, source_verdict, subpackages = components.get(
+            result['source'], (name, result['source_verdict'], []))
+        if name < first:
+            first, source_verdict = name, result['source_verdict']
+        subpackages.append(name)
+        components[result['source']] = first, source_verdict, subpackages
+    return {component: (source_verdict, sorted(subpackages))
+            for component, (_, source_verdict, subpackages) in components.items()}
+
+
+def existing_components(bzapi, trackers, path=TRACKER_CACHE):
+    """
+    Return a set of components that already have a bug blocking any of the trackers
+
+    Bugs, their components and last change times are cached in path.
+    A refresh fetches the trackers themselves, the bugs not seen before,
+    and only those of the known bugs that changed since the last sync.
+    """
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        cache = {'synced': None, 'trackers': {}, 'bugs': {}}
+    bugs = cache['bugs']  # bug id (as str) -> {'component': ..., 'changed': ...}
+
+    # A margin for clock skew, seeing a change twice is harmless
+    started = datetime.now(timezone.utc) - timedelta(minutes=5)
+
+    for tracker in bzapi.getbugs(trackers, include_fields=['id', 'depends_on']):
+        cache['trackers'][str(tracker.id)] = tracker.depends_on
+    depends_on = {bug_id for tracker in trackers
+                  for bug_id in cache['trackers'].get(str(tracker), [])}
+
+    fetched = []
+    new = sorted(bug_id for bug_id in depends_on if str(bug_id) not in bugs)
+    if new:
+        fetched += bzapi.getbugs(new, include_fields=['id', 'component', 'last_change_time'])
+    if cache['synced'] and bugs:
+        query = bzapi.build_query(include_fields=['id', 'component', 'last_change_time'])
+        query['id'] = sorted(int(bug_id) for bug_id in bugs)
+        query['last_change_time'] = cache['synced']
+        fetched += bzapi.query(query)
+    for bug in fetched:
+        bugs[str(bug.id)] = {'component': bug.component,
+                             'changed': str(bug.last_change_time)}
+
+    cache['synced'] = started.strftime('%Y-%m-%dT%H:%M:%SZ')
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp, path)
+
+    return {bugs[str(bug_id)]['component'] for bug_id in depends_on
+            if str(bug_id) in bugs}
+
+
+class Journal:
+    """
+    An append-only, fsync'd JSONL record of what was filed for which component
+
+    An "intent" line is written before a bug is created and a "done" line after.
+    A "failed" line means Bugzilla refused the bug, so it is safe to try again.
+    A component with an intent but no outcome might or might not have a bug,
+    reconcile() looks it up on the trackers.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = {}  # component -> weburl
+        self.pending = set()
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        self._update(json.loads(line))
+                    except json.JSONDecodeError:
+                        pass  # a line cut short by a crash, its bug is still pending
+        except FileNotFoundError:
+            pass
+        self.file = open(path, 'a')
+
+    def _update(self, entry):
+        component, state = entry['component'], entry['state']
+        self.pending.discard(component)
+        if state == 'intent':
+            self.pending.add(component)
+        elif state == 'done':
+            self.done[component] = entry['weburl']
+
+    def record(self, component, state, **fields):
+        """Durably append an entry, safe to be called from multiple threads"""
+        entry = {'component': component, 'state': state, **fields}
+        with self.lock:
+            self.file.write(json.dumps(entry) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self._update(entry)
+
+    def handled(self, component):
+        """Whether the component was filed or has an unresolved attempt to be filed"""
+        if component in self.pending:
+            print(f'{component} might have been filed, run with --resume to find out',
+                  file=sys.stderr)
+            return True
+        return component in self.done
+
+    def reconcile(self, bzapi, trackers):
+        """
+        Resolve the pending components with a single query
+
+        Bugs for those components that block any of the trackers count as done,
+        the rest as failed, to be filed again.
+        """
+        if not self.pending:
+            return
+        query = bzapi.build_query(product='Fedora', component=sorted(self.pending),
+                                  include_fields=['id', 'component', 'blocks'])
+        for bug in bzapi.query(query):
+            if bug.component in self.pending and set(bug.blocks) & set(trackers):
+                self.record(bug.component, 'done', id=bug.id, weburl=bug.weburl)
+        for component in sorted(self.pending):
+            self.record(component, 'failed', error='not found on the trackers')
+
+
+def file_bugs(bzapi, createinfos, concurrency=CONCURRENCY, rate=RATE, journal=None):
+    """
+    Create bugs concurrently, at most concurrency requests at a time and rate per second
+
+    createinfos is a list of (component, createinfo) tuples,
+    yields (component, new bug or exception) tuples in the same order.
+    If a journal is given, the intent and outcome of each request is recorded there.
+    """
+    limiter = RateLimiter(rate)
+
+    def create(component, createinfo):
+        if journal is not None:
+            journal.record(component, 'intent')
+        try:
+            newbug = call_with_retries(bzapi.createbug, createinfo, limiter=limiter,
+                                       idempotent=False)
+        except TRANSIENT_ERRORS as e:
+            if journal is not None and not_processed(e):
+                journal.record(component, 'failed', error=str(e))
+            return e  # otherwise the bug might exist, the intent stays unresolved
+        except Exception as e:
+            if journal is not None:
+                journal.record(component, 'failed', error=str(e))
+            return e
+        if journal is not None:
+            journal.record(component, 'done', id=newbug.id, weburl=newbug.weburl)
+        return newbug
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = executor.map(create, *zip(*createinfos)) if createinfos else ()
+        for (component, _), result in zip(createinfos, results):
+            yield component, result
+
+
+def format_list(pkgs):
+    return "\n".join(f" * {pkg}" for pkg in pkgs)
+
+
+class Campaign:
+    """
+    A mass filing campaign, described by a JSON spec file with the following keys:
+
+      trackers: bug IDs the filed bugs block, existing bugs are looked up on them
+      cc: e-mails to CC on the filed bugs
+      summary_retire, summary_drop: summary formats, with {pkg} and {sum_list}
+      template_retire, template_drop: description template files, with {pkg} and {subpkgs},
+                                      relative to the spec file
+      input: where the components come from, any of:
+        portingdb: path to portingdb results.json, drop_now subpackages are filed,
+                   as retire if their source_verdict is retire_now
+        drop: {component: [subpackages to drop]}, or a path to a JSON file with that,
+              e.g. from obsolete_packages.py --closure
+        retire: [components to retire]
+      journal: the default journal path
+    """
+    def __init__(self, path):
+        with open(path) as f:
+            spec = json.load(f)
+        self.trackers = spec['trackers']
+        self.cc = spec['cc']
+        self.input = spec['input']
+        self.journal = spec['journal']
+        self.summaries = {'retire': spec['summary_retire'].format,
+                          'drop': spec['summary_drop'].format}
+        self.templates = {}
+        for kind in 'retire', 'drop':
+            template = os.path.join(os.path.dirname(path), spec[f'template_{kind}'])
+            with open(template) as f:
+                self.templates[kind] = f.read().rstrip('\n').format
+
+    def entries(self):
+        """Yield (component, 'retire' or 'drop', sorted subpackages) tuples"""
+        if 'portingdb' in self.input:
+            components = portingdb_components(self.input['portingdb'])
+            for component, (source_verdict, subpackages) in components.items():
+                kind = 'retire' if source_verdict == 'retire_now' else 'drop'
+                yield component, kind, subpackages
+        drop = self.input.get('drop', {})
+        if isinstance(drop, str):
+            with open(drop) as f:
+                drop = json.load(f)
+        for component, subpackages in drop.items():
+            yield component, 'drop', sorted(subpackages)
+        for component in self.input.get('retire', []):
+            yield component, 'retire', []
+
+    def render(self, component, kind, subpackages):
+        """Return the build_createbug() arguments for a component"""
+        if len(subpackages) > 4:
+            sum_list = ', '.join(subpackages[:4]) + '...'
+        else:
+            sum_list = ', '.join(subpackages)
+        return dict(
+            product="Fedora",
+            version="rawhide",
+            component=component,
+            cc=self.cc,
+            blocks=self.trackers,
+            summary=self.summaries[kind](pkg=component, sum_list=sum_list),
+            description=self.templates[kind](pkg=component, subpkgs=format_list(subpackages)))
+
+
+def dry_run(campaign, path):
+    """Render the bugs of a campaign into path, report the rendering throughput"""
+    start = time.monotonic()
+    rendered = 0
+    if path.endswith('/'):
+        os.makedirs(path, exist_ok=True)
+        jsonl = None
+    else:
+        jsonl = open(path, 'w')
+    for component, kind, subpackages in campaign.entries():
+        if rendered >= MAXBUGZ:
+            break
+        payload = campaign.render(component, kind, subpackages)
+        if jsonl is None:
+            with open(os.path.join(path, f'{component}.json'), 'w') as f:
+                json.dump(payload, f, indent=4)
+        else:
+            jsonl.write(json.dumps(payload) + '\n')
+        rendered += 1
+    if jsonl is not None:
+        jsonl.close()
+    elapsed = time.monotonic() - start
+    print(f'Rendered {rendered} bugs in {elapsed:.2f} s '
+          f'({rendered / elapsed if elapsed else 0:.0f} bugs/s)', file=sys.stderr)
+
+
+def main(spec=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('spec', nargs='?' if spec else None, default=spec,
+                        help='the campaign spec file')
+    parser.add_argument('--journal',
+                        help='where to record the filed bugs, to skip them on restarts')
+    parser.add_argument('--resume', action='store_true',
+                        help='look up components with unresolved filing attempts on the trackers')
+    parser.add_argument('--dry-run', metavar='PATH',
+                        help='only render the bugs into a JSONL file, '
+                             'or a directory of JSON files if PATH ends with /, '
+                             'without contacting Bugzilla')
+    args = parser.parse_args()
+
+    campaign = Campaign(args.spec)
+    if args.dry_run:
+        dry_run(campaign, args.dry_run)
+        return
+
+    bzapi = connect()
+
+    journal = Journal(state_path(args.journal or campaign.journal))
+    if args.resume:
+        journal.reconcile(bzapi, campaign.trackers)
+
+    # Get a set of components for which the bugs already exists (on any tracker),
+    # only bugs changed since the last run are fetched again
+    existing_bugz_components = existing_components(bzapi, campaign.trackers,
+                                                   state_path(TRACKER_CACHE))
+
+    # Similar to build_query, build_createbug is a helper function that handles
+    # some bugzilla version incompatibility issues. All it does is return a
+    # properly formatted dict(), and provide friendly parameter names.
+    # The argument names map to those accepted by XMLRPC Bug.create:
+    # https://bugzilla.readthedocs.io/en/latest/api/core/v1/bug.html#create-bug
+    #
+    # The arguments specified here are mandatory, but there are many other
+    # optional ones like op_sys, platform, etc. See the docs
+    createinfos = []
+    for component, kind, subpackages in campaign.entries():
+        if component in existing_bugz_components or journal.handled(component):
+            continue
+        if len(createinfos) >= MAXBUGZ:
+            break
+        createinfo = bzapi.build_createbug(**campaign.render(component, kind, subpackages))
+        createinfos.append((component, createinfo))
+
+    # The requests are sent concurrently (CONCURRENCY, RATE and RETRIES env vars),
+    # the output keeps the order of components
+    for component, newbug in file_bugs(bzapi, createinfos, journal=journal):
+        if isinstance(newbug, Exception):
+            print(f"{component} failed: {newbug}", file=sys.stderr)
+        else:
+            print(f"{component} {newbug.weburl}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+# loadtest.py: Benchmarks of the filing scripts on synthetic inputs, without Bugzilla
+#
+# Usage: loadtest.py parse [--entries 100000]
+#        loadtest.py render [--components 50000] [--spec campaigns/<campaign>.json]
+#        loadtest.py close [--bugs 5000] [--chunks 100,1000] [--concurrency 1,4] [--latency 0.05]
+#        loadtest.py load [--bugs 1000] [--latencies 0,0.1,0.3] [--server]
+#
+# Every benchmark runs in a child process, its wall time (and peak RSS of parse) is reported.
+# The scripts talk to the in-memory fakebz.FakeBugzilla, with simulated latency,
+# or with --server to python-bugzilla and a fakebz.py XML-RPC server shared by all of them.
+
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+import filing
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def synthetic_results(path, entries, seed=0, components=None):
+    """
+    Write a portingdb results.json with given number of subpackages, streamed
+
+    The first subpackage of each component is drop_now, about a third of the others are,
+    subpackages of one component are not adjacent.
+    There are entries // 3 components by default.
+    """
+    rng = random.Random(seed)
+    components = max(components or entries // 3, 1)
+    with open(path, 'w') as f:
+        f.write('{')
+        for i in range(entries):
+            first = i < components
+            source = f'component{i if first else rng.randrange(components)}'
+            result = {
+                'source': source,
+                'verdict': 'drop_now' if first else rng.choice(('drop_now', 'keep', 'keep')),
+                'source_verdict': rng.choice(('retire_now', 'keep')),
+                'note': f'{source} subpackage {i} ' * 4,
+            }
+            f.write(f'{"," if i else ""}\n{json.dumps(f"python2-{source}-sub{i}")}: ')
+            json.dump(result, f)
+        f.write('\n}\n')
+
+
+def measure(func, *args):
+    """Run func(*args) in a child process, return its wall time (s) and peak RSS (KiB)"""
+    start = time.monotonic()
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            func(*args)
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+    _, status, rusage = os.wait4(pid, 0)
+    if status:
+        raise RuntimeError(f'{func.__name__} failed')
+    return time.monotonic() - start, rusage.ru_maxrss
+
+
+def report(name, elapsed, rss):
+    print(f'{name:<24} {elapsed:8.2f} s {rss / 1024:8.1f} MiB peak RSS')
+
+
+def json_load_components(path):
+    """The former way: load everything, then scan all results per component"""
+    with open(path) as f:
+        results = json.load(f)
+    return {result['source'] for result in results.values() if result['verdict'] == 'drop_now'}
+
+
+def bench_parse(args):
+    """portingdb_components() (streaming) and a plain json.load() on synthetic results"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'results.json')
+        synthetic_results(path, args.entries, args.seed)
+        size = os.path.getsize(path) / 1024 / 1024
+        print(f'{args.entries} entries, {size:.1f} MiB')
+        report('baseline', *measure(lambda: None))
+        report('portingdb_components', *measure(filing.portingdb_components, path))
+        report('json.load', *measure(json_load_components, path))
+
+
+def synthetic_campaign(tmp, spec, results):
+    """Write a copy of a campaign spec with the results as its portingdb input, return its path"""
+    with open(spec) as f:
+        campaign = json.load(f)
+    for kind in 'retire', 'drop':
+        template = campaign[f'template_{kind}']
+        campaign[f'template_{kind}'] = os.path.join(os.path.dirname(os.path.abspath(spec)), template)
+    campaign['input'] = {'portingdb': results}
+    name = os.path.basename(spec)
+    campaign['journal'] = os.path.join(tmp, f'{name}.journal')
+    path = os.path.join(tmp, name)
+    with open(path, 'w') as f:
+        json.dump(campaign, f)
+    return path
+
+
+def bench_render(args):
+    """Dry-run rendering of a campaign with synthetic components, into JSONL and a directory"""
+    with tempfile.TemporaryDirectory() as tmp:
+        results = os.path.join(tmp, 'results.json')
+        synthetic_results(results, args.components * 3, args.seed, args.components)
+        campaign = filing.Campaign(synthetic_campaign(tmp, args.spec, results))
+        components = len(filing.portingdb_components(results))
+        print(f'{components} components to file')
+        report('parse', *measure(filing.portingdb_components, results))
+        report('dry run to JSONL', *measure(filing.dry_run, campaign,
+                                            os.path.join(tmp, 'bugs.jsonl')))
+        report('dry run to directory', *measure(filing.dry_run, campaign,
+                                                os.path.join(tmp, 'bugs') + '/'))
+
+
+def fake_env(args, **settings):
+    """Environment for a script talking to the fake Bugzilla with the configured behavior"""
+    env = dict(os.environ,
+               BUGZILLA_BACKEND='fake',
+               FAKEBZ_LATENCY=str(args.latency),
+               FAKEBZ_PER_BUG=str(args.per_bug),
+               FAKEBZ_RPS=str(args.rps),
+               FAKEBZ_SEED=str(args.seed))
+    env.update((name, str(value)) for name, value in settings.items())
+    return env
+
+
+def run_script(script, env, stdin='', *args, cwd=None):
+    """Run one of the scripts, return its wall time, output and the fakebz throughput report"""
+    start = time.monotonic()
+    process = subprocess.Popen([sys.executable, os.path.join(HERE, script), *args],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, env=env, text=True, cwd=cwd)
+    stdout, stderr = process.communicate(stdin)
+    elapsed = time.monotonic() - start
+    if process.returncode:
+        raise RuntimeError(f'{script} failed:\n{stderr}')
+    calls = [line for line in stderr.splitlines() if line.startswith('fakebz:')]
+    return elapsed, stdout, calls
+
+
+def bench_close(args):
+    """close.py on synthetic bug IDs, for each chunk size and concurrency"""
+    ids = '\n'.join(str(bug_id) for bug_id in range(3_000_000, 3_000_000 + args.bugs))
+    for chunk in args.chunks:
+        for concurrency in args.concurrency:
+            env = fake_env(args, CHUNK=chunk, CONCURRENCY=concurrency, RATE=args.rate)
+            elapsed, _, calls = run_script('close.py', env, ids)
+            print(f'{args.bugs} bugs, chunks of {chunk}, concurrency {concurrency}: '
+                  f'{elapsed:.2f} s, {args.bugs / elapsed:.0f} bugs/s  ({"; ".join(calls)})')
+
+
+def start_server(args, latency, port=8765):
+    """Start fakebz.py as an XML-RPC server, return the process and its URL"""
+    env = fake_env(args, FAKEBZ_LATENCY=latency)
+    server = subprocess.Popen([sys.executable, os.path.join(HERE, 'fakebz.py'), '--port', str(port)],
+                              env=env, stderr=subprocess.PIPE, text=True)
+    server.stderr.readline()  # serving ...
+    return server, f'http://localhost:{port}/xmlrpc.cgi'
+
+
+def bench_load(args):
+    """
+    Create bugs as create.py and create_f32.py do, then close them with close.py
+
+    Each of them is run at each simulated latency, the throughput is reported.
+    """
+    specs = [('create.py', 'f33-mass-python2-package-removal.json'),
+             ('create_f32.py', 'f32-retire-python2.json')]
+    for latency in args.latencies:
+        with tempfile.TemporaryDirectory() as tmp:
+            server = None
+            env = fake_env(args, FAKEBZ_LATENCY=latency, MAXBUGZ=args.bugs, RATE=args.rate,
+                           TRACKER_CACHE=os.path.join(tmp, 'tracker_cache.json'))
+            if args.server:
+                server, url = start_server(args, latency)
+                env.update(BUGZILLA_BACKEND='real', BUGZILLA_URL=url)
+            try:
+                results = os.path.join(tmp, 'results.json')
+                synthetic_results(results, args.bugs * 3, args.seed, args.bugs)
+                ids = []
+                for script, spec in specs:
+                    spec = synthetic_campaign(tmp, os.path.join(HERE, 'campaigns', spec), results)
+                    elapsed, stdout, calls = run_script('filing.py', env, '', spec, cwd=tmp)
+                    created = re.findall(r'id=(\d+)$', stdout, re.MULTILINE)
+                    ids += created
+                    print(f'latency {latency} s: {script} created {len(created)} bugs in '
+                          f'{elapsed:.2f} s, {len(created) / elapsed:.1f} bugs/s  ({"; ".join(calls)})')
+                elapsed, _, calls = run_script('close.py', env, '\n'.join(ids), cwd=tmp)
+                print(f'latency {latency} s: close.py closed {len(ids)} bugs in {elapsed:.2f} s, '
+                      f'{len(ids) / elapsed:.1f} bugs/s  ({"; ".join(calls)})')
+            finally:
+                if server is not None:
+                    server.terminate()
+                    server.wait()
+
+
+def numbers(value):
+    return [int(number) for number in value.split(',')]
+
+
+def floats(value):
+    return [float(number) for number in value.split(',')]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the filing scripts on synthetic inputs, without Bugzilla')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed for the synthetic inputs (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='simulated seconds per Bugzilla call (default: %(default)s)')
+    parser.add_argument('--per-bug', type=float, default=0.001,
+                        help='simulated seconds per bug in a call (default: %(default)s)')
+    parser.add_argument('--rps', type=float, default=0,
+                        help='simulated Bugzilla rate limit, 0 means none (default: %(default)s)')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='RATE of the scripts, 0 means unlimited (default: %(default)s)')
+    benchmarks = parser.add_subparsers(dest='benchmark', required=True)
+    parse = benchmarks.add_parser('parse', help='streaming portingdb results parsing')
+    parse.add_argument('--entries', type=int, default=100000,
+                       help='subpackages in the results file (default: %(default)s)')
+    parse.set_defaults(func=bench_parse)
+    render = benchmarks.add_parser('render', help='dry-run rendering of a campaign')
+    render.add_argument('--components', type=int, default=50000,
+                        help='how many components to render (default: %(default)s)')
+    render.add_argument('--spec', default=os.path.join(HERE, 'campaigns',
+                                                       'f33-mass-python2-package-removal.json'),
+                        help='the campaign to take the templates from (default: %(default)s)')
+    render.set_defaults(func=bench_render)
+    close = benchmarks.add_parser('close', help='closing bugs with close.py')
+    close.add_argument('--bugs', type=int, default=5000,
+                       help='how many bugs to close (default: %(default)s)')
+    close.add_argument('--chunks', type=numbers, default=[100, 1000], metavar='N,N,...',
+                       help='CHUNK sizes to compare (default: 100,1000)')
+    close.add_argument('--concurrency', type=numbers, default=[1, 4], metavar='N,N,...',
+                       help='CONCURRENCY values to compare (default: 1,4)')
+    close.set_defaults(func=bench_close)
+    load = benchmarks.add_parser('load', help='filing and closing bugs at several latencies')
+    load.add_argument('--bugs', type=int, default=1000,
+                      help='how many bugs each campaign files (default: %(default)s)')
+    load.add_argument('--latencies', type=floats, default=[0, 0.1, 0.3], metavar='S,S,...',
+                      help='simulated seconds per Bugzilla call (default: 0,0.1,0.3)')
+    load.add_argument('--server', action='store_true',
+                      help='use python-bugzilla with a fakebz.py XML-RPC server')
+    load.set_defaults(func=bench_load)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
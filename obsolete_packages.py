@@ -1,8 +1,17 @@
-import dnf
+import argparse
+import cProfile
+import difflib
+import json
+import os
 import re
-import subprocess
+import resource
+import shutil
+import sqlite3
 import sys
-from collections import defaultdict
+import time
+from array import array
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
 
 
 FIRST = 14  # Python 2.7 introduced
@@ -10,11 +19,42 @@ EOL = 29  # the largest Fedora version that is EOL
 RAWHIDEVER = 33  # Fedora rawhide version
 
 DNF_CACHEDIR = '_dnf_cache_dir'
+SACK_WORKERS = int(os.getenv('SACK_WORKERS', os.cpu_count() or 1))
+INDEX_MAX_AGE = float(os.getenv('INDEX_MAX_AGE', 24)) * 3600  # seconds
+OFFLINE = False  # only use DNF_CACHEDIR as is, never touch the network or expire anything
+# a baseurl with {version} and {arch} of local (e.g. file://) repos to use instead of the mirrors
+REPO_BASEURL = os.getenv('REPO_BASEURL')
 ARCH = 'x86_64'
+ARCHES_32BIT = ('i686', 'armv7hl')
+# the globals above that can change at runtime, see worker_config()
+WORKER_SETTINGS = ('FIRST', 'EOL', 'RAWHIDEVER', 'DNF_CACHEDIR', 'SACK_WORKERS', 'INDEX_MAX_AGE',
+                   'OFFLINE', 'REPO_BASEURL', 'ARCH')
+
+METRICS = os.getenv('METRICS')  # where to write a JSON report of timers and counters
+PROFILE = os.getenv('PROFILE')  # where to dump cProfile stats (for pstats)
 
 INTSTART = re.compile(r'^(\d+).+')
+VERSEGMENT = re.compile(r'[A-Za-z]+|[0-9]+|~|\^')
+RELDEP = re.compile(r'^(\S+) (<=|>=|=|<|>) (\S+)$')
+OBSOLETE_LINE = re.compile(r'^%obsolete\s+(\S+)\s+(\S+)\s*$')
+SPEC_SECTION = re.compile(r'^%(description|package|prep|build|install|check|files|changelog)\b')
+
+indexes = {}  # a global registry of opened release indexes
+spec_obsoletes = {}  # package names to EVRs already %obsoleted in the spec, see --spec
+
+Package = namedtuple('Package', 'name evr arch source')
+
+# a global registry of timers (seconds), counters and sack memory (KiB of RSS growth)
+metrics = {'timers': defaultdict(float), 'counters': defaultdict(int), 'sack_rss': {}}
 
-sacks = {}  # a global registry of dnf sacks
+INDEX_SCHEMA = '''
+CREATE TABLE packages (id INTEGER PRIMARY KEY, name TEXT, evr TEXT, arch TEXT, source TEXT);
+CREATE TABLE deps (pkg INTEGER, kind TEXT, name TEXT, flags TEXT, evr TEXT);
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE INDEX packages_name ON packages (name);
+CREATE INDEX deps_kind_name ON deps (kind, name);
+CREATE INDEX deps_pkg ON deps (pkg);
+'''
 
 # modularity problems :(
 # https://bugzilla.redhat.com/show_bug.cgi?id=1636285
@@ -27,119 +67,665 @@ excludepkgs = ('fedora-release,fedora-release-cinnamon,fedora-release-cloud,'
                'fedora-release-xfce,generic-release')
 
 
-def rawhide_sack():
-    """A DNF sack for rawhide, used for queries, cached"""
+@contextmanager
+def timed(name):
+    """Add the time spent in the with block to the named timer and count it"""
+    start = time.perf_counter()
     try:
-        return sacks[RAWHIDEVER]
-    except KeyError:
-        pass
-    base = dnf.Base()
-    conf = base.conf
-    conf.cachedir = DNF_CACHEDIR
-    conf.substitutions['releasever'] = str(RAWHIDEVER)
-    conf.substitutions['basearch'] = ARCH
-    base.repos.add_new_repo('rawhide', conf,
-        metalink='https://mirrors.fedoraproject.org/metalink?repo=rawhide&arch=$basearch',
+        yield
+    finally:
+        metrics['timers'][name] += time.perf_counter() - start
+        metrics['counters'][name] += 1
+
+
+def write_metrics(path=METRICS):
+    """Write the collected metrics as JSON, if a path is configured"""
+    if not path:
+        return
+    report = dict(metrics,
+                  peak_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+def current_rss():
+    """
+    The current resident memory of this process (KiB)
+
+    Unlike ru_maxrss, this goes down when memory is freed,
+    so it measures every sack, not only those bigger than all the previous ones.
+    Falls back to ru_maxrss without /proc.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+def _fill_sack(base, version, arch):
+    """Fill the sack of a dnf base, measure the time and the memory growth"""
+    before = current_rss()
+    with timed('fill_sack'):
+        base.fill_sack(load_system_repo=False, load_available_repos=True)
+    after = current_rss()
+    metrics['sack_rss'][f'{version}-{arch}'] = after - before
+
+
+def _add_repo(base, repoid, metalink):
+    """Add a repo to a dnf base, offline repos never expire, REPO_BASEURL replaces the metalink"""
+    options = {'metadata_expire': -1} if OFFLINE else {}
+    if REPO_BASEURL:
+        version, arch = base.conf.substitutions['releasever'], base.conf.substitutions['basearch']
+        options['baseurl'] = [REPO_BASEURL.format(version=version, arch=arch)]
+    else:
+        options['metalink'] = metalink
+    base.repos.add_new_repo(repoid, base.conf,
         skip_if_unavailable=False,
         enabled=True,
-        excludepkgs=excludepkgs)
-    base.fill_sack(load_system_repo=False, load_available_repos=True)
-    sacks[RAWHIDEVER] = base.sack
-    return base.sack
+        excludepkgs=excludepkgs,
+        **options)
 
 
-def fedora_sack(version):
-    """A DNF sack factory, used for queries, cached"""
-    try:
-        return sacks[version]
-    except KeyError:
-        pass
+def _new_base(version, arch):
+    """A dnf base for given Fedora version and arch, cache only when OFFLINE"""
+    import dnf  # slow to import, only needed to build the indexes
     base = dnf.Base()
     conf = base.conf
     conf.cachedir = DNF_CACHEDIR
+    conf.cacheonly = OFFLINE
     conf.substitutions['releasever'] = str(version)
-    conf.substitutions['basearch'] = ARCH
-    base.repos.add_new_repo(f'fedora{version}', conf,
-        metalink='https://mirrors.fedoraproject.org/metalink?repo=fedora-$releasever&arch=$basearch',
-        skip_if_unavailable=False,
-        enabled=True,
-        excludepkgs=excludepkgs)
-    base.repos.add_new_repo(f'updates{version}', conf,
-        metalink='https://mirrors.fedoraproject.org/metalink?repo=updates-released-f$releasever&arch=$basearch',
-        skip_if_unavailable=False,
-        enabled=True,
-        excludepkgs=excludepkgs)
-    base.repos.add_new_repo(f'updates-testing{version}', conf,
-        metalink='https://mirrors.fedoraproject.org/metalink?repo=updates-testing-f$releasever&arch=$basearch',
-        skip_if_unavailable=False,
-        enabled=True,
-        excludepkgs=excludepkgs)
-    base.fill_sack(load_system_repo=False, load_available_repos=True)
-    sacks[version] = base.sack
+    conf.substitutions['basearch'] = arch
+    return base
+
+
+def rawhide_sack(arch=None):
+    """A DNF sack for rawhide, only used to build its index"""
+    arch = arch or ARCH
+    base = _new_base(RAWHIDEVER, arch)
+    _add_repo(base, f'rawhide-{arch}',
+              'https://mirrors.fedoraproject.org/metalink?repo=rawhide&arch=$basearch')
+    _fill_sack(base, RAWHIDEVER, arch)
+    return base.sack
+
+
+def fedora_sack(version, arch=None):
+    """A DNF sack factory, only used to build the indexes"""
+    arch = arch or ARCH
+    base = _new_base(version, arch)
+    _add_repo(base, f'fedora{version}-{arch}',
+              'https://mirrors.fedoraproject.org/metalink?repo=fedora-$releasever&arch=$basearch')
+    if not REPO_BASEURL:  # a local repo is the whole release
+        _add_repo(base, f'updates{version}-{arch}',
+                  'https://mirrors.fedoraproject.org/metalink?repo=updates-released-f$releasever&arch=$basearch')
+        _add_repo(base, f'updates-testing{version}-{arch}',
+                  'https://mirrors.fedoraproject.org/metalink?repo=updates-testing-f$releasever&arch=$basearch')
+    _fill_sack(base, version, arch)
     return base.sack
 
 
+def release_sack(version, arch=None):
+    """A DNF sack for given Fedora version (rawhide included)"""
+    if version == RAWHIDEVER:
+        return rawhide_sack(arch)
+    return fedora_sack(version, arch)
+
+
+def parse_reldep(reldep):
+    """
+    Given a dependency string, return (name, flags, evr) tuple
+
+    Unversioned and rich dependencies have empty flags and evr.
+    """
+    match = RELDEP.match(reldep)
+    if match:
+        return match.groups()
+    return reldep, '', ''
+
+
+def index_path(version, arch):
+    """Path to the on-disk index of given Fedora version and arch ('noarch' for the shared part)"""
+    return os.path.join(DNF_CACHEDIR, 'index', f'fedora{version}-{arch}.sqlite')
+
+
+def index_is_fresh(version, arch):
+    """
+    Whether the on-disk index of given Fedora version and arch can be used as is
+
+    Indexes of EOL Fedoras never go stale, the others do after INDEX_MAX_AGE,
+    unless OFFLINE.
+    """
+    try:
+        built = os.path.getmtime(index_path(version, arch))
+    except FileNotFoundError:
+        return False
+    return OFFLINE or version <= EOL or time.time() - built < INDEX_MAX_AGE
+
+
+def _write_index(path, pkgs):
+    """Store given (id, hawkey package) pairs into an SQLite file at path, atomically"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    if os.path.exists(tmp):
+        os.unlink(tmp)
+    db = sqlite3.connect(tmp)
+    db.executescript(INDEX_SCHEMA)
+    for pkg_id, pkg in pkgs:
+        db.execute('INSERT INTO packages VALUES (?, ?, ?, ?, ?)',
+                   (pkg_id, pkg.name, pkg.evr, pkg.arch, pkg.source_name))
+        for kind in ('requires', 'provides', 'obsoletes'):
+            db.executemany('INSERT INTO deps VALUES (?, ?, ?, ?, ?)',
+                           ((pkg_id, kind, *parse_reldep(str(reldep)))
+                            for reldep in getattr(pkg, kind)))
+    db.execute('INSERT INTO meta VALUES (?, ?)', ('built', str(time.time())))
+    db.commit()
+    db.close()
+    os.replace(tmp, path)
+
+
+def build_index(version, arch=None, noarch=True):
+    """
+    Extract name, EVR and dependencies of all packages of given Fedora version and arch
+
+    The arch specific packages are stored into one SQLite file,
+    the noarch packages (only if noarch is true) into another one, shared by all arches.
+    The noarch packages get negative ids, so the two never clash.
+    The sack is released, all later queries are answered from the indexes.
+    Returns the version, arch, elapsed seconds and memory growth of the sack (KiB).
+    """
+    arch = arch or ARCH
+    start = time.monotonic()
+    metrics['counters']['build_index'] += 1
+    sack = release_sack(version, arch)
+    pkgs = list(sack.query())
+    _write_index(index_path(version, arch),
+                 ((i, pkg) for i, pkg in enumerate(pkgs, 1) if pkg.arch != 'noarch'))
+    if noarch:
+        _write_index(index_path(version, 'noarch'),
+                     ((-i, pkg) for i, pkg in enumerate(pkgs, 1) if pkg.arch == 'noarch'))
+    del sack, pkgs
+    return version, arch, time.monotonic() - start, metrics['sack_rss'].get(f'{version}-{arch}')
+
+
+def release_index(version, arch=None):
+    """
+    An SQLite connection to the index of given Fedora version and arch, built if needed, cached
+
+    The shared noarch index is attached as the noarch schema, see query_index().
+    """
+    arch = arch or ARCH
+    try:
+        return indexes[(version, arch)]
+    except KeyError:
+        pass
+    noarch_fresh = index_is_fresh(version, 'noarch')
+    if not index_is_fresh(version, arch) or not noarch_fresh:
+        build_index(version, arch, noarch=not noarch_fresh)
+    db = sqlite3.connect(index_path(version, arch))
+    db.execute('ATTACH DATABASE ? AS noarch', (index_path(version, 'noarch'),))
+    for schema in 'main', 'noarch':
+        # indexes of EOL Fedoras built before deps_pkg existed are never rebuilt
+        db.execute(f'CREATE INDEX IF NOT EXISTS {schema}.deps_pkg ON deps (pkg)')
+    indexes[(version, arch)] = db
+    return db
+
+
+def query_index(db, sql, params=(), order_by=None):
+    """
+    Run a query on the arch index and on the attached noarch index, return all rows
+
+    The {schema} placeholders in sql are filled with each schema, the two queries are
+    combined with UNION ALL, so every join happens inside one database and uses its indexes.
+    A view over both would be materialized before joining, that is very slow.
+    Use named parameters, they are shared by both queries.
+    """
+    sql = ' UNION ALL '.join(sql.format(schema=schema) for schema in ('main', 'noarch'))
+    if order_by:
+        sql += f' ORDER BY {order_by}'
+    return db.execute(sql, params)
+
+
+def worker_config():
+    """
+    The settings main() changes, to be set again in worker processes by _init_worker()
+
+    Workers started with spawn or forkserver do not inherit them.
+    """
+    return {'settings': {name: globals()[name] for name in WORKER_SETTINGS},
+            'spec_obsoletes': dict(spec_obsoletes)}
+
+
+def _init_worker(config):
+    """Initialize a worker process with a worker_config() of its parent"""
+    globals().update(config['settings'])
+    spec_obsoletes.clear()
+    spec_obsoletes.update(config['spec_obsoletes'])
+    indexes.clear()  # sqlite connections inherited over fork are not safe to use
+
+
+def _build_index_job(job):
+    return build_index(*job)
+
+
+def preload_indexes(versions, arches=None, workers=None):
+    """
+    Build the indexes of all given Fedora versions and arches in parallel, unless fresh
+
+    Each worker loads one sack at a time and only the index leaves the process.
+    The shared noarch index of a version is built with its first arch only.
+    With workers <= 1, the indexes are built serially, by default SACK_WORKERS are used.
+    Returns the number of indexes built.
+    """
+    arches = arches or [ARCH]
+    workers = SACK_WORKERS if workers is None else workers
+    jobs = []
+    for version in versions:
+        noarch = not index_is_fresh(version, 'noarch')
+        for arch in arches:
+            if noarch or not index_is_fresh(version, arch):
+                jobs.append((version, arch, noarch))
+            noarch = False
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            build_index(*job)
+        return len(jobs)
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(worker_config(),)) as executor:
+        for version, arch, elapsed, rss in executor.map(_build_index_job, jobs):
+            print(f'Fedora {version} {arch} indexed in {elapsed:.1f} s',
+                  file=sys.stderr)
+            # the workers' metrics die with them, collect what matters
+            metrics['timers']['build_index (workers)'] += elapsed
+            metrics['sack_rss'][f'{version}-{arch}'] = rss
+    return len(jobs)
+
+
+def _whatprovides(db, kind, reldep):
+    """Packages which have a given kind of dependency that overlaps with reldep"""
+    name, flags, evr = parse_reldep(reldep)
+    rows = query_index(db, 'SELECT DISTINCT p.id, p.name, p.evr, p.arch, p.source, d.flags, d.evr '
+                           'FROM {schema}.deps d JOIN {schema}.packages p ON p.id = d.pkg '
+                           'WHERE d.kind = :kind AND d.name = :name',
+                       {'kind': kind, 'name': name}, order_by=1)
+    found = {}
+    for pkg_id, *pkg, dep_flags, dep_evr in rows:
+        if pkg_id not in found and ranges_overlap(flags, evr, dep_flags, dep_evr):
+            found[pkg_id] = Package(*pkg)
+    return list(found.values())
+
+
 def repoquery(*args, **kwargs):
     """
     A Python function that somehow works as the repoquery command.
 
     Only supports --whatrequires, --whatobsoletes, --requires and --all.
+    Answered from the release index, dnf sacks are only loaded to build it.
     """
     version = kwargs.pop('version', RAWHIDEVER)
-    if version == RAWHIDEVER:
-        sack = rawhide_sack()
-    else:
-        sack = fedora_sack(version)
+    arch = kwargs.pop('arch', None)
+    db = release_index(version, arch)
+    with timed(f"repoquery {' '.join(sorted(kwargs))}"):
+        return _repoquery(db, **kwargs)
+
+
+def _repoquery(db, **kwargs):
     if 'whatrequires' in kwargs:
-        return sack.query().available().filter(requires=kwargs['whatrequires'])
+        return _whatprovides(db, 'requires', kwargs['whatrequires'])
     if 'whatobsoletes' in kwargs:
-        return sack.query().filter(obsoletes=kwargs['whatobsoletes'])
+        return _whatprovides(db, 'obsoletes', kwargs['whatobsoletes'])
     if 'requires' in kwargs:
-        pkgs = sack.query().filter(name=kwargs['requires'], latest=1).run()
-        return pkgs[0].requires
+        pkgs = query_index(db, 'SELECT id, evr FROM {schema}.packages WHERE name = :name',
+                           {'name': kwargs['requires']}).fetchall()
+        pkg_id, _ = max(pkgs, key=lambda pkg: evr_key(pkg[1]))
+        rows = query_index(db, 'SELECT name, flags, evr FROM {schema}.deps '
+                               "WHERE kind = 'requires' AND pkg = :pkg", {'pkg': pkg_id})
+        return [' '.join(filter(None, row)) for row in rows]
     if 'all' in kwargs and kwargs['all']:
-        return sack.query()
+        return [Package(*row) for row in
+                query_index(db, 'SELECT name, evr, arch, source FROM {schema}.packages')]
     raise RuntimeError('unknown query')
 
 
-def py2_pkgs():
+def whatobsoletes_bulk(nevrs, version=None, arch=None):
+    """
+    For many (name, evr) pairs at once, find what obsoletes them
+
+    All Obsoletes of the Fedora version are read in one query and grouped by name,
+    then every pair is matched against its group only.
+    The result is the same as repoquery(whatobsoletes=f'{name} = {evr}') for each pair.
+
+    Returns a dict:
+      keys: (name, evr) tuples that are obsoleted by something
+      values: lists of packages obsoleting them
+    """
+    db = release_index(RAWHIDEVER if version is None else version, arch)
+    with timed('whatobsoletes_bulk'):
+        return _whatobsoletes_bulk(db, nevrs)
+
+
+def _whatobsoletes_bulk(db, nevrs):
+    obsoletes = defaultdict(list)
+    rows = query_index(db, 'SELECT d.pkg, d.name, d.flags, d.evr, p.name, p.evr, p.arch, p.source '
+                           'FROM {schema}.deps d JOIN {schema}.packages p ON p.id = d.pkg '
+                           "WHERE d.kind = 'obsoletes'", order_by=1)
+    for pkg_id, name, flags, evr, *pkg in rows:
+        obsoletes[name].append((pkg_id, flags, evr, Package(*pkg)))
+    result = {}
+    for name, evr in nevrs:
+        found = {}
+        for pkg_id, flags, obs_evr, pkg in obsoletes.get(name, ()):
+            if pkg_id not in found and ranges_overlap('=', evr, flags, obs_evr):
+                found[pkg_id] = pkg
+        if found:
+            result[(name, evr)] = list(found.values())
+    return result
+
+
+def libpython2(arch, debug=False):
+    """The libpython2 soname dependency for given arch"""
+    d = '_d' if debug else ''
+    bits = '' if arch in ARCHES_32BIT else '()(64bit)'
+    return f'libpython2.7{d}.so.1.0{bits}'
+
+
+def py2_pkgs_in(version, arch=None):
+    """Returns a set of all Python 2 packages ("name evr" strings) in given Fedora version"""
+    arch = arch or ARCH
+    news = set()
+    for dependency in ('python(abi) = 2.7',
+                       libpython2(arch),
+                       libpython2(arch, debug=True)):
+        pkgs = repoquery(version=version,
+                         arch=arch,
+                         whatrequires=dependency)
+        found = {f'{p.name} {p.evr}' for p in pkgs}
+        if found:
+            print(f'{len(found)} pkgs require {dependency} in Fedora {version} {arch}',
+                  file=sys.stderr)
+        news |= found
+    return news
+
+
+def py2_snapshot_path(arch):
+    """Path to the saved state of py2_pkgs() for given arch"""
+    return os.path.join(DNF_CACHEDIR, f'py2_pkgs-{arch}.json')
+
+
+def load_py2_snapshot(arch):
+    """
+    Load the saved state of py2_pkgs() for EOL Fedoras, if any
+
+    A state saved with a different FIRST, or through a Fedora newer than EOL, is ignored.
+    After raising EOL, the state is still valid up to the old EOL, py2_pkgs() goes on from there.
+    Returns the last processed Fedora version and a dict:
+      keys: package names
+      values: (last Fedora version, set of EVRs) tuples
+    """
+    try:
+        with open(py2_snapshot_path(arch)) as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return FIRST - 1, {}
+    if snapshot.get('first') != FIRST or snapshot['through'] > EOL:
+        print(f'Ignoring {py2_snapshot_path(arch)}, saved with different --first or a newer --eol',
+              file=sys.stderr)
+        return FIRST - 1, {}
+    last = {name: (version, set(evrs))
+            for name, (version, evrs) in snapshot['last'].items()}
+    return snapshot['through'], last
+
+
+def save_py2_snapshot(arch, through, last):
+    """Save the state of py2_pkgs() after processing Fedoras up to through"""
+    snapshot = {'first': FIRST,
+                'eol': EOL,
+                'through': through,
+                'last': {name: (version, sorted(evrs))
+                         for name, (version, evrs) in last.items()}}
+    path = py2_snapshot_path(arch)
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp, path)
+
+
+def py2_pkgs(arch=None):
     """
     Returns a dictionary with all Python 2 packages last known in Fedora versions
 
     keys: Fedora versions
     values: sets of packages ("name evr" strings) last known in that Fedora
+
+    Every Fedora is read once, a newer one replaces the older records of the same name.
+    EOL Fedoras never change, so their state is saved and only newer ones are read again.
     """
-    fedoras = {}
-    for version in range(FIRST, RAWHIDEVER+1):
-        fedoras[version] = set()
-        for dependency in ('python(abi) = 2.7',
-                           'libpython2.7.so.1.0()(64bit)',
-                           'libpython2.7_d.so.1.0()(64bit)'):
-            pkgs = repoquery(version=version,
-                             whatrequires=dependency)
-            news = {f'{p.name} {p.evr}' for p in pkgs}
-            if news:
-                print(f'{len(news)} pkgs require {dependency} in Fedora {version}',
-                      file=sys.stderr)
-            fedoras[version] |= set(news)
-        names = {nevr.split(' ')[0] for nevr in fedoras[version]}
-        for older_version in fedoras:
-            if older_version == version:
-                continue
-            for nevr in set(fedoras[older_version]):
-                if nevr.split(' ')[0] in names:
-                    fedoras[older_version].remove(nevr)
+    arch = arch or ARCH
+    through, last = load_py2_snapshot(arch)
+    versions = range(max(through + 1, FIRST), RAWHIDEVER+1)
+    preload_indexes(versions, [arch])
+    for version in versions:
+        evrs = defaultdict(set)
+        for nevr in py2_pkgs_in(version, arch):
+            name, _, evr = nevr.partition(' ')
+            evrs[name].add(evr)
+        for name, found in evrs.items():
+            last[name] = (version, found)
+        if version == EOL:
+            save_py2_snapshot(arch, version, last)
+    fedoras = {version: set() for version in range(FIRST, RAWHIDEVER+1)}
+    for name, (version, evrs) in last.items():
+        fedoras[version] |= {f'{name} {evr}' for evr in evrs}
     return fedoras
 
 
+def dependency_graph(version=None, arch=None):
+    """
+    Build the reverse dependency graph of a Fedora version as integer-indexed adjacency arrays
+
+    Returns a (packages, offsets, requirers) tuple:
+      packages: a list of packages, the graph nodes are indexes into it
+      requirers[offsets[n]:offsets[n+1]]: nodes that require something node n provides
+
+    File dependencies are not resolved, the index has no file lists.
+    """
+    db = release_index(RAWHIDEVER if version is None else version, arch)
+    nodes = {}
+    packages = []
+    for pkg_id, *pkg in query_index(db, 'SELECT id, name, evr, arch, source FROM {schema}.packages',
+                                    order_by=1):
+        nodes[pkg_id] = len(packages)
+        packages.append(Package(*pkg))
+
+    providers = defaultdict(list)
+    for pkg_id, name, flags, evr in query_index(
+            db, "SELECT pkg, name, flags, evr FROM {schema}.deps WHERE kind = 'provides'"):
+        providers[name].append((nodes[pkg_id], flags, evr))
+
+    edges = set()
+    for pkg_id, name, flags, evr in query_index(
+            db, "SELECT pkg, name, flags, evr FROM {schema}.deps WHERE kind = 'requires'"):
+        requirer = nodes[pkg_id]
+        for provider, provided_flags, provided_evr in providers.get(name, ()):
+            if provider != requirer and ranges_overlap(flags, evr, provided_flags, provided_evr):
+                edges.add((provider, requirer))
+
+    # compressed sparse rows: count, prefix sum, fill
+    offsets = array('l', [0]) * (len(packages) + 1)
+    for provider, _ in edges:
+        offsets[provider + 1] += 1
+    for node in range(len(packages)):
+        offsets[node + 1] += offsets[node]
+    requirers = array('l', [0]) * len(edges)
+    position = offsets[:-1]
+    for provider, requirer in edges:
+        requirers[position[provider]] = requirer
+        position[provider] += 1
+    return packages, offsets, requirers
+
+
+def reverse_closure(graph, roots):
+    """
+    Given a dependency_graph() and root nodes, return all nodes that transitively require them
+
+    The roots are included. Every node and edge is visited at most once.
+    """
+    packages, offsets, requirers = graph
+    seen = bytearray(len(packages))
+    stack = list(roots)
+    for node in stack:
+        seen[node] = 1
+    while stack:
+        node = stack.pop()
+        for requirer in requirers[offsets[node]:offsets[node + 1]]:
+            if not seen[requirer]:
+                seen[requirer] = 1
+                stack.append(requirer)
+    return [node for node, flag in enumerate(seen) if flag]
+
+
+def py2_impact(version=None, arch=None):
+    """
+    Find all packages that need Python 2, directly or transitively, grouped by component
+
+    Returns a dict:
+      keys: components (source package names)
+      values: sorted lists of their binary packages affected
+
+    The format is the same as the drop input of filing.py campaigns.
+    """
+    version = RAWHIDEVER if version is None else version
+    graph = dependency_graph(version, arch)
+    direct = py2_pkgs_in(version, arch)
+    roots = [node for node, pkg in enumerate(graph[0]) if f'{pkg.name} {pkg.evr}' in direct]
+    impact = defaultdict(set)
+    for node in reverse_closure(graph, roots):
+        pkg = graph[0][node]
+        impact[pkg.source].add(pkg.name)
+    return {component: sorted(names) for component, names in sorted(impact.items())}
+
+
+def vercmp_key(string):
+    """
+    Given a version or release string, return a key that sorts like rpmvercmp
+
+    Separators are ignored, numeric segments are newer than alphabetic ones,
+    tilde sorts before anything (even the end of the string),
+    caret sorts after the end of the string but before any other segment.
+    """
+    key = []
+    for segment in VERSEGMENT.findall(string):
+        if segment == '~':
+            key.append((0,))
+        elif segment == '^':
+            key.append((2,))
+        elif segment.isdigit():
+            key.append((4, int(segment)))
+        else:
+            key.append((3, segment))
+    key.append((1,))  # the end of the string
+    return tuple(key)
+
+
+def split_evr(evr):
+    """
+    Given epoch:version-release string, return (epoch, version, release) tuple
+
+    Epoch defaults to 0, release defaults to an empty string.
+    """
+    epoch, _, vr = evr.rpartition(':')
+    version, _, release = vr.partition('-')
+    return int(epoch or 0), version, release
+
+
+def evr_key(evr):
+    """Given epoch:version-release string, return a key that sorts like RPM"""
+    epoch, version, release = split_evr(evr)
+    return epoch, vercmp_key(version), vercmp_key(release)
+
+
+def rpmvercmp(one, two):
+    """
+    Compare two version (or release) strings the same way as rpmvercmp()
+
+    Returns 1 if one is newer, 0 if they are equal, -1 if two is newer.
+
+    Examples:
+      1.0 vs 1.0 -> 0
+      1.0 vs 2.0 -> -1
+      2.0.1 vs 2.0 -> 1
+      2.0.1a vs 2.0.1 -> 1
+      5.5p1 vs 5.5p10 -> -1
+      10xyz vs 10.1xyz -> -1
+      xyz10 vs xyz10.1 -> -1
+      1.0 vs 1.0a -> -1
+      a vs 1 -> -1
+      1.0010 vs 1.9 -> 1
+      1.05 vs 1.5 -> 0
+      2.0 vs 2_0 -> 0
+      2.0 vs 2..0 -> 0
+      1.0~rc1 vs 1.0 -> -1
+      1.0~rc1 vs 1.0~rc2 -> -1
+      1.0~rc1~git123 vs 1.0~rc1 -> -1
+      1.0^ vs 1.0 -> 1
+      1.0^git1 vs 1.0.1 -> -1
+      1.0^git1~pre vs 1.0^git1 -> -1
+      1.0~rc1^git1 vs 1.0~rc1 -> 1
+    """
+    one, two = vercmp_key(one), vercmp_key(two)
+    return (one > two) - (one < two)
+
+
+def evr_compare(one, two):
+    """
+    Compare two epoch:version-release strings the same way as RPM dependencies
+
+    Releases are only compared when both EVRs have one.
+    Returns 1 if one is newer, 0 if they are equal, -1 if two is newer.
+    """
+    epoch1, version1, release1 = split_evr(one)
+    epoch2, version2, release2 = split_evr(two)
+    if epoch1 != epoch2:
+        return 1 if epoch1 > epoch2 else -1
+    sense = rpmvercmp(version1, version2)
+    if sense == 0 and release1 and release2:
+        sense = rpmvercmp(release1, release2)
+    return sense
+
+
+def ranges_overlap(flags1, evr1, flags2, evr2):
+    """
+    Whether two dependency ranges of the same name overlap, like rpmdsCompare()
+
+    Flags are '<', '<=', '=', '>=', '>' or empty for unversioned dependencies.
+
+    Examples:
+      < 1.2-3 vs = 1.2-2 -> True
+      < 1.2-3 vs = 1.2-3 -> False
+      <= 1.2 vs = 1.2-3 -> True
+      > 1.2 vs = 1.2-3 -> False
+      (empty) vs = 1.2-3 -> True
+    """
+    if not flags1 or not flags2:
+        return True
+    sense = evr_compare(evr1, evr2)
+    if sense < 0:
+        return '>' in flags1 or '<' in flags2
+    if sense > 0:
+        return '<' in flags1 or '>' in flags2
+    return any(f in flags1 and f in flags2 for f in '=<>')
+
+
 class SortableEVR:
     """
     A way to sort package epoch:version-releases.
 
-    Could be faster if not using subprocess, but is fast enough, so meh.
+    The sort key is computed once, comparisons don't parse anything.
     """
     def __init__(self, evr):
         self.evr = evr
+        self.key = evr_key(evr)
 
     def __repr__(self):
         return f"evr'{self.evr}'"
@@ -148,11 +734,10 @@ class SortableEVR:
         return self.evr == other.evr
 
     def __lt__(self, other):
-        return subprocess.call(('rpmdev-vercmp', self.evr, other.evr),
-                               stdout=subprocess.DEVNULL) == 12
+        return self.key < other.key
 
 
-def removed_pkgs():
+def removed_pkgs(arch=None):
     """
     Gather all packages that are no longer present in Fedora rawhide.
 
@@ -167,17 +752,19 @@ def removed_pkgs():
         values: newest (RPM-aware) known epcoh-version-release string
     """
     name_versions = defaultdict(set)
-    fedoras = py2_pkgs()
+    with timed('py2_pkgs'):
+        fedoras = py2_pkgs(arch)
     last_fedoras = defaultdict(set)
-    new = {pkg.name for pkg in repoquery(all=True)}
+    new = {pkg.name for pkg in repoquery(all=True, arch=arch)}
     for version in fedoras:
         for name_evr in set(fedoras[version]):
             name, _, evr = name_evr.partition(' ')
             if name not in new:
                 name_versions[name].add(evr)
                 last_fedoras[version].add(name)
-    max_versions = {name: max(versions, key=SortableEVR)
-                    for name, versions in name_versions.items()}
+    with timed('max_versions'):
+        max_versions = {name: max(versions, key=SortableEVR)
+                        for name, versions in name_versions.items()}
     return last_fedoras, max_versions
 
 
@@ -251,45 +838,373 @@ def format_obsolete(pkg, evr):
     return f'%obsolete {pkg} {evr}'
 
 
-last_fedoras, max_versions = removed_pkgs()
+def normalize_evrs(evrs):
+    """
+    Given an iterable of epoch:version-release strings, normalize and bump them all at once
+
+    Returns a list of (normalized, bumped) tuples, in the same order:
+      normalized is the EVR without the dist tag and 0 epoch (as drop_0epoch(drop_dist(evr)))
+      bumped is bump_release(normalized), or None if it cannot be bumped
+
+    Every distinct EVR is only processed once, repository snapshots repeat them a lot.
+    """
+    done = {}
+    results = []
+    for evr in evrs:
+        try:
+            results.append(done[evr])
+            continue
+        except KeyError:
+            pass
+        normalized = drop_0epoch(drop_dist(evr))
+        try:
+            bumped = bump_release(normalized)
+        except ValueError:
+            bumped = None
+        done[evr] = normalized, bumped
+        results.append(done[evr])
+    return results
 
-# Enough of functions, main spaghetti incoming
 
-for fed_version in sorted(last_fedoras):
-    print(f'\n# Python 2 packages removed in Fedora {fed_version+1} but never obsoleted')
-    for pkg in sorted(last_fedoras[fed_version]):
+def parse_spec(path):
+    """
+    Read the %obsolete lines of a fedora-obsolete-packages spec file
 
-        # First, ignore packages that only require the 2 things we still have: python(abi) and libpython2
-        requires = repoquery(requires=pkg, version=fed_version)
-        for require in requires:
-            if require not in ('', 'python(abi) = 2.7', 'libpython2.7.so.1.0()(64bit)'):
-                # a different require
-                break
+    Returns a dict of package names to the (already bumped) EVRs they are obsoleted with.
+    """
+    obsoleted = {}
+    with open(path) as f:
+        for line in f:
+            match = OBSOLETE_LINE.match(line)
+            if match:
+                obsoleted[match.group(1)] = match.group(2)
+    return obsoleted
+
+
+def covered_by_spec(pkg, bumped):
+    """Whether the spec already obsoletes a package of this or a newer version (already bumped)"""
+    if bumped is None or pkg not in spec_obsoletes:
+        return False
+    return evr_compare(spec_obsoletes[pkg], bumped) >= 0
+
+
+def spec_patch(path, obsoletes):
+    """
+    Return a unified diff adding the missing %obsolete lines to a fedora-obsolete-packages spec
+
+    The lines of packages already obsoleted with an older EVR are updated in place,
+    the new ones are appended after the last %obsolete line, grouped by Fedora version.
+    Without any %obsolete lines, they are put at the end of the preamble,
+    before the first section (e.g. %description). A spec with neither is refused.
+    obsoletes is the same dict as returned by obsoletes_for_arches().
+    """
+    with open(path) as f:
+        old = f.readlines()
+    new = list(old)
+    changed = {pkg: pkg_version
+               for release in obsoletes.values()
+               for pkg, pkg_version in release if pkg in spec_obsoletes}
+    last = section = None
+    for lineno, line in enumerate(new):
+        match = OBSOLETE_LINE.match(line)
+        if match:
+            last = lineno + 1
+            if match.group(1) in changed:
+                new[lineno] = format_obsolete(match.group(1), changed[match.group(1)]) + '\n'
+        elif section is None and SPEC_SECTION.match(line):
+            section = lineno
+    added = []
+    for fed_version in sorted(obsoletes):
+        lines = [format_obsolete(pkg, pkg_version) + '\n'
+                 for pkg, pkg_version in sorted(obsoletes[fed_version]) if pkg not in changed]
+        if lines:
+            added.append(f'# Python 2 packages removed in Fedora {fed_version+1} but never obsoleted\n')
+            added.extend(lines)
+    if added and last is None:
+        if section is None:
+            raise ValueError(f'{path} has neither %obsolete lines nor sections to put them before')
+        last = section
+        added.append('\n')
+    new[last:last] = added
+    return ''.join(difflib.unified_diff(old, new, f'a/{os.path.basename(path)}',
+                                        f'b/{os.path.basename(path)}'))
+
+
+def only_requires_python2(pkg, version, arch=None):
+    """Whether the package only requires the 2 things we still have: python(abi) and libpython2"""
+    requires = repoquery(requires=pkg, version=version, arch=arch)
+    for require in requires:
+        if require not in ('', 'python(abi) = 2.7', libpython2(arch or ARCH)):
+            # a different require
+            return False
+    return True
+
+
+def _worker_job(func, *args):
+    """Call func in a worker process, its metrics are sent back with the result"""
+    metrics['timers'].clear()
+    metrics['counters'].clear()
+    return func(*args), metrics['timers'], metrics['counters']
+
+
+def parallel_map(func, argslist, workers=1):
+    """
+    Call func with each of the argument tuples, in up to workers processes
+
+    Returns the results in the same order, the metrics of the workers are added to ours.
+    With workers <= 1, everything runs serially in this process.
+    Workers are initialized with worker_config(), so they do not depend on fork.
+    """
+    if workers <= 1 or len(argslist) <= 1:
+        return [func(*args) for args in argslist]
+    from concurrent.futures import ProcessPoolExecutor
+    results = []
+    with ProcessPoolExecutor(max_workers=min(workers, len(argslist)), initializer=_init_worker,
+                             initargs=(worker_config(),)) as executor:
+        futures = [executor.submit(_worker_job, func, *args) for args in argslist]
+        for future in futures:
+            result, timers, counters = future.result()
+            results.append(result)
+            for name, value in timers.items():
+                metrics['timers'][name] += value
+            for name, value in counters.items():
+                metrics['counters'][name] += value
+    return results
+
+
+def _release_candidates(fed_version, pkgs, arch=None):
+    """
+    Split packages last known in fed_version to those that only require Python 2 and the rest
+
+    Only needs the index of fed_version, so the releases can be evaluated in parallel.
+    pkgs is a list of (package name, version) tuples.
+    Returns a tuple (dict of the rest of the package names to versions, list of the others).
+    """
+    candidates, only_python2 = {}, []
+    for pkg, pkg_version in pkgs:
+        if only_requires_python2(pkg, fed_version, arch):
+            only_python2.append(pkg)
         else:
-            # all requires are within norm
+            candidates[pkg] = pkg_version
+    return candidates, only_python2
+
+
+def obsolete_candidates(last_fedoras, max_versions, arch=None, workers=1):
+    """
+    Filter out removed packages that only require Python 2
+    and those already obsoleted in the spec (see --spec), without looking at them further
+
+    The packages are sharded by the Fedora version they were last known in,
+    each evaluated in one of up to workers processes.
+
+    Returns a dict:
+      keys: Fedora versions
+      values: dicts of package names to versions (without dist tag and 0 epoch)
+    """
+    jobs = []
+    for fed_version in sorted(last_fedoras):
+        pkgs = []
+        names = sorted(last_fedoras[fed_version])
+        evrs = normalize_evrs(max_versions[pkg] for pkg in names)
+        for pkg, (pkg_version, bumped) in zip(names, evrs):
+            if covered_by_spec(pkg, bumped):
+                metrics['counters']['covered by spec'] += 1
+                continue
+            pkgs.append((pkg, pkg_version))
+        if pkgs:
+            jobs.append((fed_version, pkgs, arch))
+    candidates = defaultdict(dict)
+    for (fed_version, *_), (release, only_python2) in zip(
+            jobs, parallel_map(_release_candidates, jobs, workers)):
+        for pkg in only_python2:
             print(f'# {pkg} only requires Python 2', file=sys.stderr)
-            continue
+        if release:
+            candidates[fed_version] = release
+    return candidates
+
+
+def obsoleted_by_release(candidates, arch=None, workers=1):
+    """
+    Match all candidates against all Obsoletes of each release at once
+
+    Each release is matched in one of up to workers processes.
+
+    Returns a dict:
+      keys: Fedora versions, from the oldest candidate's one to rawhide
+      values: whatobsoletes_bulk() results for that release
+    """
+    fedoras = range(min(candidates, default=RAWHIDEVER), RAWHIDEVER+1)
+    jobs = [([(pkg, pkg_version)
+              for fed_version in candidates if fed_version <= fedora
+              for pkg, pkg_version in candidates[fed_version].items()], fedora, arch)
+            for fedora in fedoras]
+    return dict(zip(fedoras, parallel_map(whatobsoletes_bulk, jobs, workers)))
+
+
+def needs_obsolete(pkg, pkg_version, fed_version, obsoleted):
+    """
+    Whether a package last known in fed_version needs to be obsoleted by fedora-obsolete-packages
+
+    It does not if it was obsoleted in 2 consequent releases,
+    or if it is obsoleted in rawhide by something else.
+    The order of the obsoleting packages does not matter, the indexes do not keep the sack order.
+    """
+    obsoleted_previous = False
+    for fedora in range(fed_version, RAWHIDEVER):
+        whatobsoletes = obsoleted[fedora].get((pkg, pkg_version), [])
+        if whatobsoletes:
+            if obsoleted_previous:
+                print(f'# {pkg} obsoleted in Fedora {fedora-1} and {fedora}', file=sys.stderr)
+                return False
+            obsoleted_previous = True
+        else:
+            obsoleted_previous = False
+
+    whatobsoletes = [p for p in obsoleted[RAWHIDEVER].get((pkg, pkg_version), [])
+                     if p.name != 'fedora-obsolete-packages']
+    if not whatobsoletes:
+        return True
+    obs = ', '.join(p.name for p in whatobsoletes)
+    print(f'# {pkg} {pkg_version} obsoleted by {obs}', file=sys.stderr)
+    return False
+
+
+def obsoletes_for_arch(arch, workers=1):
+    """
+    Compute what needs to be obsoleted on one arch, in up to workers processes
+
+    Returns a dict:
+      keys: Fedora versions with Python 2 packages last known in them
+      values: sets of (package name, version) tuples to obsolete
+    """
+    with timed('removed_pkgs'):
+        last_fedoras, max_versions = removed_pkgs(arch)
+    with timed('requires_filter'):
+        candidates = obsolete_candidates(last_fedoras, max_versions, arch, workers)
+    with timed('whatobsoletes'):
+        obsoleted = obsoleted_by_release(candidates, arch, workers)
+    return {fed_version: {(pkg, pkg_version)
+                          for pkg, pkg_version in candidates[fed_version].items()
+                          if needs_obsolete(pkg, pkg_version, fed_version, obsoleted)}
+            for fed_version in last_fedoras}
+
+
+def obsoletes_for_arches(arches):
+    """
+    Compute what needs to be obsoleted on all given arches
+
+    The indexes of all arches are built in parallel first, sharing the noarch data,
+    then each arch is evaluated in its own worker process.
+    A single arch is evaluated with its releases sharded over the worker processes instead.
+
+    Returns a dict:
+      keys: Fedora versions with Python 2 packages last known in them
+      values: dicts of (package name, version) tuples to sets of arches they are obsoleted on
+    """
+    start = time.monotonic()
+    built = preload_indexes(range(FIRST, RAWHIDEVER+1), arches)
+    kind = 'cold' if built else 'warm'
+    elapsed = time.monotonic() - start
+    metrics['start'] = {'kind': kind, 'seconds': elapsed, 'indexes_built': built}
+    print(f'{kind.capitalize()} start, {built} indexes built in {elapsed:.2f} s', file=sys.stderr)
+    if len(arches) == 1:
+        results = [obsoletes_for_arch(arches[0], SACK_WORKERS)]
+    else:
+        results = parallel_map(obsoletes_for_arch, [(arch,) for arch in arches], SACK_WORKERS)
+    merged = defaultdict(lambda: defaultdict(set))
+    for arch, result in zip(arches, results):
+        for fed_version, obsoletes in result.items():
+            release = merged[fed_version]  # created even with nothing to obsolete
+            for pkg_version in obsoletes:
+                release[pkg_version].add(arch)
+    return merged
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Print %obsolete lines for Python 2 packages removed from Fedora but never obsoleted')
+    parser.add_argument('--first', type=int, default=FIRST,
+                        help='the first Fedora version to look at (default: %(default)s)')
+    parser.add_argument('--eol', type=int, default=EOL,
+                        help='the largest Fedora version that is EOL (default: %(default)s)')
+    parser.add_argument('--rawhide', type=int, default=RAWHIDEVER,
+                        help='the Fedora rawhide version (default: %(default)s)')
+    parser.add_argument('--arch', action='append', dest='arches',
+                        help='the architecture to look at, can be repeated (default: %s)' % ARCH)
+    parser.add_argument('--cachedir', default=DNF_CACHEDIR,
+                        help='where to keep dnf metadata and indexes (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=SACK_WORKERS,
+                        help='how many processes to index and evaluate releases with (default: %(default)s)')
+    parser.add_argument('--offline', action='store_true',
+                        help='only use what is in the cache dir, no network, no metadata expiry')
+    parser.add_argument('--freeze', metavar='DIR',
+                        help='build all indexes, then copy the cache dir (repodata, solv files, '
+                             'indexes) to DIR, to be used later with --cachedir DIR --offline')
+    parser.add_argument('--closure', metavar='PATH',
+                        help='instead of the %%obsolete lines, write a JSON of all components '
+                             'needing Python 2 in rawhide, directly or transitively, '
+                             'usable as the drop input of a filing.py campaign')
+    parser.add_argument('--spec', metavar='PATH',
+                        help='an existing fedora-obsolete-packages spec file, only print a patch '
+                             'for what is missing in it, packages already in it are not evaluated')
+    parser.add_argument('--metrics', default=METRICS,
+                        help='where to write a JSON report of timers and counters')
+    parser.add_argument('--profile', default=PROFILE,
+                        help='where to dump cProfile stats')
+    return parser.parse_args(argv)
+
+
+def run(args, arches):
+    """Do what the command line asks for, main() sets the globals and measures it"""
+    if args.freeze:
+        preload_indexes(range(FIRST, RAWHIDEVER+1), arches)
+        shutil.copytree(DNF_CACHEDIR, args.freeze, dirs_exist_ok=True,
+                        ignore=shutil.ignore_patterns('*.tmp'))
+        return
+
+    if args.closure:
+        with timed('closure'):
+            impact = py2_impact()
+        with open(args.closure, 'w') as f:
+            json.dump(impact, f, indent=4)
+        return
+
+    if args.spec:
+        spec_obsoletes.update(parse_spec(args.spec))
 
-        pkg_version = drop_0epoch(drop_dist(max_versions[pkg]))
-
-        # check if the removed package was not obsoleted in 2 consequent releases
-        obsoleted_previous = False
-        for fedora in range(fed_version, RAWHIDEVER):
-            whatobsoletes = list(repoquery(whatobsoletes=f'{pkg} = {pkg_version}', version=fedora))
-            if whatobsoletes:
-                if obsoleted_previous:
-                    print(f'# {pkg} obsoleted in Fedora {fedora-1} and {fedora}', file=sys.stderr)
-                    break
-                obsoleted_previous = True
-            else:
-                obsoleted_previous = False
-
-        # if not, maybe it is obsoleted in rawhide by something other than fedora-obsolete-packages
+    obsoletes = obsoletes_for_arches(arches)
+
+    with timed('output'):
+        if args.spec:
+            sys.stdout.write(spec_patch(args.spec, obsoletes))
         else:
-            whatobsoletes = list(repoquery(whatobsoletes=f'{pkg} = {pkg_version}'))
-            if not whatobsoletes or whatobsoletes[0].name == 'fedora-obsolete-packages':
-                # finally, yes, we obsolete this
-                print(format_obsolete(pkg, pkg_version))
-            else:
-                obs = ', '.join(p.name for p in whatobsoletes)
-                print(f'# {pkg} {pkg_version} obsoleted by {obs}', file=sys.stderr)
+            for fed_version in sorted(obsoletes):
+                print(f'\n# Python 2 packages removed in Fedora {fed_version+1} but never obsoleted')
+                for (pkg, pkg_version), pkg_arches in sorted(obsoletes[fed_version].items()):
+                    if len(pkg_arches) < len(arches):
+                        print(f'# only on {", ".join(sorted(pkg_arches))}')
+                    print(format_obsolete(pkg, pkg_version))
+
+
+def main(argv=None):
+    global FIRST, EOL, RAWHIDEVER, ARCH, DNF_CACHEDIR, SACK_WORKERS, OFFLINE
+    args = parse_args(argv)
+    FIRST, EOL, RAWHIDEVER = args.first, args.eol, args.rawhide
+    DNF_CACHEDIR, SACK_WORKERS, OFFLINE = args.cachedir, args.workers, args.offline
+    arches = args.arches or [ARCH]
+    ARCH = arches[0]
+
+    if args.profile:
+        profile = cProfile.Profile()
+        profile.enable()
+    try:
+        run(args, arches)
+    finally:
+        if args.profile:
+            profile.disable()
+            profile.dump_stats(args.profile)
+        write_metrics(args.metrics)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+# synthetic_repos.py: Generate synthetic Fedora releases to benchmark obsolete_packages.py
+#
+# Usage: synthetic_repos.py CACHEDIR [--packages N] [--py2 RATIO] [--churn RATIO] ...
+#        synthetic_repos.py --bench 1000,10000 [--workers 1,4] [--history bench.jsonl]
+#        synthetic_repos.py --bench-whatobsoletes --packages 5000
+#        synthetic_repos.py --bench-normalize --packages 50000
+#
+# The releases are written directly as the per-release indexes obsolete_packages.py
+# answers all its queries from, so it can run against them with --cachedir CACHEDIR --offline.
+# With --bench, the whole pipeline is run at each scale in a fresh cache dir,
+# and its timers (py2_pkgs, removed_pkgs, max_versions, requires_filter, whatobsoletes)
+# are appended to a JSON lines history, to be compared over time.
+# With --repodata, local repositories are written instead, for REPO_BASEURL of
+# obsolete_packages.py, and the benchmark includes loading them into dnf sacks,
+# serially (--workers 1) or in a process pool.
+#
+# Fedora FIRST to RAWHIDEVER of obsolete_packages.py are generated, with --releases N
+# Fedora FIRST to FIRST+N-1 instead, use --rawhide FIRST+N-1 --eol FIRST+N-5 with them.
+
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from xml.sax.saxutils import quoteattr
+
+import obsolete_packages as op
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def lifecycles(args, rng):
+    """
+    Decide the fate of every synthetic package, the same for all arches
+
+    Returns a list of dicts with the name, first and last Fedora version of the package,
+    whether it is noarch, requires Python 2, its epoch and the versions it was updated in.
+    """
+    pkgs = []
+    for i in range(args.packages):
+        py2 = rng.random() < args.py2
+        if py2 and rng.random() < args.removed:
+            first = rng.randint(op.FIRST, op.RAWHIDEVER - 1)
+            last = rng.randint(first, op.RAWHIDEVER - 1)
+        else:
+            first = rng.randint(op.FIRST, op.RAWHIDEVER)
+            last = op.RAWHIDEVER
+        pkgs.append({
+            'name': f'python2-synthetic{i}' if py2 else f'synthetic{i}',
+            'first': first,
+            'last': last,
+            'noarch': rng.random() < args.noarch,
+            'py2': py2,
+            'only_py2': py2 and rng.random() < 0.05,
+            'epoch': rng.choice((0, 0, 0, 1)),
+            'updates': {v for v in range(first + 1, last + 1) if rng.random() < args.churn},
+            'obsoleted': rng.random() < args.obsoletes,
+        })
+    return pkgs
+
+
+def release_rows(pkgs, version, arch):
+    """Yield (package row, dependency rows) for all packages of one release and arch"""
+    for pkg in pkgs:
+        if not pkg['first'] <= version <= pkg['last'] or pkg['noarch'] != (arch == 'noarch'):
+            continue
+        major = 1 + sum(1 for v in pkg['updates'] if v <= version)
+        epoch = f'{pkg["epoch"]}:' if pkg['epoch'] else ''
+        evr = f'{epoch}{major}.{version % 3}-{version - pkg["first"] + 1}.fc{version}'
+        deps = [('provides', pkg['name'], '=', evr)]
+        if pkg['py2']:
+            deps.append(('requires', 'python(abi)', '=', '2.7'))
+            if arch != 'noarch':
+                deps.append(('requires', op.libpython2(arch), '', ''))
+        if not pkg['only_py2']:
+            deps.append(('requires', 'glibc' if arch != 'noarch' else 'bash', '', ''))
+        yield (pkg['name'], evr, arch, pkg['name']), deps
+
+
+def obsoletes_rows(pkgs, version, rng):
+    """
+    Yield (package row, dependency rows) for noarch packages obsoleting removed ones
+
+    Every obsoleted package is obsoleted by a successor for a few releases after its removal,
+    fedora-obsolete-packages obsoletes some of the rest.
+    """
+    retired = []
+    for pkg in pkgs:
+        if pkg['last'] < version <= pkg['last'] + 3 and pkg['obsoleted']:
+            yield ((f'{pkg["name"]}-successor', f'1-1.fc{version}', 'noarch', pkg['name']),
+                   [('obsoletes', pkg['name'], '<', f'{pkg["epoch"]}:{version}')])
+        elif pkg['last'] < version and rng.random() < 0.2:
+            retired.append(('obsoletes', pkg['name'], '<', f'{pkg["epoch"]}:{version}'))
+    yield ('fedora-obsolete-packages', f'{version}-1.fc{version}', 'noarch',
+           'fedora-obsolete-packages'), retired
+
+
+def write_release(path, rows, sign):
+    """Write an index in the obsolete_packages.py format, ids are negative for noarch"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.unlink(path)
+    db = sqlite3.connect(path)
+    db.executescript(op.INDEX_SCHEMA)
+    for i, (pkg, deps) in enumerate(rows, 1):
+        db.execute('INSERT INTO packages VALUES (?, ?, ?, ?, ?)', (sign * i, *pkg))
+        db.executemany('INSERT INTO deps VALUES (?, ?, ?, ?, ?)',
+                       ((sign * i, *dep) for dep in deps))
+    db.execute('INSERT INTO meta VALUES (?, ?)', ('built', str(time.time())))
+    db.commit()
+    db.close()
+
+
+FLAGS = {'<': 'LT', '<=': 'LE', '=': 'EQ', '>=': 'GE', '>': 'GT'}
+
+
+def evr_attributes(evr):
+    """The epoch, ver and rel XML attributes of an EVR"""
+    epoch, version, release = op.split_evr(evr)
+    attributes = f'epoch="{epoch}" ver={quoteattr(version)}'
+    return attributes + (f' rel={quoteattr(release)}' if release else '')
+
+
+def primary_xml(rows):
+    """Yield the lines of a primary.xml with the packages of given rows"""
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield ('<metadata xmlns="http://linux.duke.edu/metadata/common" '
+           'xmlns:rpm="http://linux.duke.edu/metadata/rpm" '
+           f'packages="{len(rows)}">\n')
+    for (name, evr, arch, source), deps in rows:
+        _, version, release = op.split_evr(evr)
+        nvra = f'{name}-{version}-{release}.{arch}'
+        yield (f'<package type="rpm"><name>{name}</name><arch>{arch}</arch>'
+               f'<version {evr_attributes(evr)}/>'
+               f'<checksum type="sha256" pkgid="YES">{hashlib.sha256(nvra.encode()).hexdigest()}</checksum>'
+               f'<summary>{name}</summary><description>{name}</description>'
+               '<packager/><url/><time file="0" build="0"/>'
+               '<size package="0" installed="0" archive="0"/>'
+               f'<location href="Packages/{nvra}.rpm"/>'
+               '<format><rpm:license>MIT</rpm:license>'
+               f'<rpm:sourcerpm>{source}-{version}-{release}.src.rpm</rpm:sourcerpm>'
+               '<rpm:header-range start="0" end="0"/>\n')
+        for kind in 'provides', 'requires', 'obsoletes':
+            entries = [(dep_name, flags, dep_evr)
+                       for dep_kind, dep_name, flags, dep_evr in deps if dep_kind == kind]
+            if entries:
+                yield f'<rpm:{kind}>'
+                for dep_name, flags, dep_evr in entries:
+                    versioned = f' flags="{FLAGS[flags]}" {evr_attributes(dep_evr)}' if flags else ''
+                    yield f'<rpm:entry name={quoteattr(dep_name)}{versioned}/>'
+                yield f'</rpm:{kind}>\n'
+        yield '</format></package>\n'
+    yield '</metadata>\n'
+
+
+def write_repo(path, rows):
+    """Write a repository with only primary metadata (enough for dnf queries) into path"""
+    os.makedirs(os.path.join(path, 'repodata'), exist_ok=True)
+    xml = ''.join(primary_xml(rows)).encode()
+    compressed = gzip.compress(xml, mtime=0)
+    with open(os.path.join(path, 'repodata', 'primary.xml.gz'), 'wb') as f:
+        f.write(compressed)
+    timestamp = int(time.time())
+    with open(os.path.join(path, 'repodata', 'repomd.xml'), 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<repomd xmlns="http://linux.duke.edu/metadata/repo" '
+                'xmlns:rpm="http://linux.duke.edu/metadata/rpm">\n'
+                f'<revision>{timestamp}</revision>\n'
+                '<data type="primary">'
+                f'<checksum type="sha256">{hashlib.sha256(compressed).hexdigest()}</checksum>'
+                f'<open-checksum type="sha256">{hashlib.sha256(xml).hexdigest()}</open-checksum>'
+                '<location href="repodata/primary.xml.gz"/>'
+                f'<timestamp>{timestamp}</timestamp>'
+                f'<size>{len(compressed)}</size><open-size>{len(xml)}</open-size>'
+                '</data>\n</repomd>\n')
+
+
+def repo_path(cachedir, version, arch):
+    return os.path.join(cachedir, 'repos', f'fedora{version}-{arch}')
+
+
+def generate(args, cachedir):
+    """
+    Write all synthetic releases and arches into cachedir
+
+    As the indexes obsolete_packages.py uses, or as repositories with args.repodata,
+    to be used with REPO_BASEURL=file://CACHEDIR/repos/fedora{version}-{arch}.
+    """
+    op.DNF_CACHEDIR = cachedir
+    # saved py2_pkgs() states of releases generated before would be used as is
+    for snapshot in glob.glob(op.py2_snapshot_path('*')):
+        os.unlink(snapshot)
+    rng = random.Random(args.seed)
+    pkgs = lifecycles(args, rng)
+    for version in range(op.FIRST, op.RAWHIDEVER + 1):
+        noarch = [*release_rows(pkgs, version, 'noarch'), *obsoletes_rows(pkgs, version, rng)]
+        for arch in args.arches:
+            if args.repodata:
+                write_repo(repo_path(cachedir, version, arch),
+                           [*release_rows(pkgs, version, arch), *noarch])
+            else:
+                write_release(op.index_path(version, arch), release_rows(pkgs, version, arch), 1)
+        if not args.repodata:
+            write_release(op.index_path(version, 'noarch'), noarch, -1)
+
+
+def revision():
+    """The git revision benchmarked, if known"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench(args):
+    """
+    Run obsolete_packages.py at each scale and number of workers, record its timers
+
+    With args.repodata, the indexes are built from local repositories by dnf sacks,
+    so the serial (1 worker) and parallel sack loading can be compared.
+    """
+    for packages in args.bench:
+        for workers in args.workers:
+            args.packages = packages
+            with tempfile.TemporaryDirectory() as cachedir:
+                generate(args, cachedir)
+                report = os.path.join(cachedir, 'metrics.json')
+                env = dict(os.environ)
+                if args.repodata:
+                    env['REPO_BASEURL'] = 'file://' + repo_path(os.path.abspath(cachedir),
+                                                                '{version}', '{arch}')
+                start = time.monotonic()
+                subprocess.run([sys.executable, os.path.join(HERE, 'obsolete_packages.py'),
+                                '--first', str(op.FIRST), '--eol', str(op.EOL),
+                                '--rawhide', str(op.RAWHIDEVER), '--cachedir', cachedir,
+                                *([] if args.repodata else ['--offline']),
+                                '--workers', str(workers), '--metrics', report,
+                                *(f'--arch={arch}' for arch in args.arches)],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               check=True)
+                elapsed = time.monotonic() - start
+                with open(report) as f:
+                    metrics = json.load(f)
+            result = {
+                'packages': packages,
+                'py2': args.py2,
+                'churn': args.churn,
+                'arches': args.arches,
+                'releases': op.RAWHIDEVER - op.FIRST + 1,
+                'workers': workers,
+                'repodata': args.repodata,
+                'seconds': elapsed,
+                'timers': metrics['timers'],
+                'peak_rss': metrics['peak_rss'],
+            }
+            print(f'{packages:>8} packages, {workers:>2} workers: {elapsed:8.2f} s  ' +
+                  '  '.join(f'{name} {seconds:.2f}'
+                            for name, seconds in sorted(metrics['timers'].items())))
+            record(args, result)
+
+
+def bench_whatobsoletes(args):
+    """
+    Time repoquery(whatobsoletes=...) per package and release against whatobsoletes_bulk()
+
+    All removed Python 2 packages are matched in every release, the results must be identical.
+    """
+    arch = args.arches[0]
+    with tempfile.TemporaryDirectory() as cachedir:
+        generate(args, cachedir)
+        op.OFFLINE = True
+        last_fedoras, max_versions = op.removed_pkgs(arch)
+        nevrs = sorted((name, op.drop_0epoch(op.drop_dist(evr)))
+                       for name, evr in max_versions.items())
+        single = bulk = 0
+        for version in range(op.FIRST, op.RAWHIDEVER + 1):
+            op.release_index(version, arch)  # not timed
+            start = time.perf_counter()
+            expected = {}
+            for name, evr in nevrs:
+                found = op.repoquery(whatobsoletes=f'{name} = {evr}', version=version, arch=arch)
+                if found:
+                    expected[(name, evr)] = found
+            single += time.perf_counter() - start
+            start = time.perf_counter()
+            found = op.whatobsoletes_bulk(nevrs, version, arch)
+            bulk += time.perf_counter() - start
+            if found != expected:
+                raise AssertionError(f'whatobsoletes_bulk() differs in Fedora {version}')
+        op.indexes.clear()
+    print(f'{args.packages} packages, {len(nevrs)} candidates, '
+          f'{op.RAWHIDEVER - op.FIRST + 1} releases: '
+          f'per package {single:.2f} s, bulk {bulk:.2f} s, {single / bulk:.1f}x faster')
+    record(args, {'benchmark': 'whatobsoletes', 'packages': args.packages,
+                  'candidates': len(nevrs), 'single': single, 'bulk': bulk})
+
+
+def bench_normalize(args):
+    """
+    Time drop_0epoch(drop_dist()) and bump_release() per package against normalize_evrs()
+
+    The EVRs of all packages of all releases are used, the results must be identical.
+    """
+    arch = args.arches[0]
+    with tempfile.TemporaryDirectory() as cachedir:
+        generate(args, cachedir)
+        op.OFFLINE = True
+        evrs = [pkg.evr for version in range(op.FIRST, op.RAWHIDEVER + 1)
+                for pkg in op.repoquery(all=True, version=version, arch=arch)]
+        op.indexes.clear()
+    start = time.perf_counter()
+    expected = []
+    for evr in evrs:
+        normalized = op.drop_0epoch(op.drop_dist(evr))
+        try:
+            expected.append((normalized, op.bump_release(normalized)))
+        except ValueError:
+            expected.append((normalized, None))
+    single = time.perf_counter() - start
+    start = time.perf_counter()
+    found = op.normalize_evrs(evrs)
+    batch = time.perf_counter() - start
+    if found != expected:
+        raise AssertionError('normalize_evrs() differs')
+    print(f'{len(evrs)} EVRs, {len(set(evrs))} distinct: '
+          f'per package {single:.2f} s, normalize_evrs {batch:.2f} s, {single / batch:.1f}x faster')
+    record(args, {'benchmark': 'normalize', 'packages': args.packages,
+                  'evrs': len(evrs), 'single': single, 'batch': batch})
+
+
+def record(args, result):
+    """Append a benchmark result to the history, with the date and revision"""
+    if not args.history:
+        return
+    result = dict(result,
+                  date=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                  revision=revision())
+    with open(args.history, 'a') as f:
+        print(json.dumps(result, sort_keys=True), file=f)
+
+
+def numbers(value):
+    return [int(number) for number in value.split(',')]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Generate synthetic Fedora release indexes, or benchmark obsolete_packages.py on them')
+    parser.add_argument('cachedir', nargs='?',
+                        help='where to write the indexes, use as --cachedir of obsolete_packages.py')
+    parser.add_argument('--packages', type=int, default=10000,
+                        help='how many packages ever exist (default: %(default)s)')
+    parser.add_argument('--py2', type=float, default=0.2,
+                        help='ratio of packages requiring Python 2 (default: %(default)s)')
+    parser.add_argument('--removed', type=float, default=0.8,
+                        help='ratio of Python 2 packages removed before rawhide (default: %(default)s)')
+    parser.add_argument('--noarch', type=float, default=0.4,
+                        help='ratio of noarch packages (default: %(default)s)')
+    parser.add_argument('--churn', type=float, default=0.3,
+                        help='chance of a package being updated in a release (default: %(default)s)')
+    parser.add_argument('--obsoletes', type=float, default=0.3,
+                        help='ratio of removed packages obsoleted by a successor (default: %(default)s)')
+    parser.add_argument('--releases', type=int,
+                        help='how many Fedora releases to generate, from %d, the last one is rawhide '
+                             '(default: %d)' % (op.FIRST, op.RAWHIDEVER - op.FIRST + 1))
+    parser.add_argument('--arch', action='append', dest='arches',
+                        help='the architecture to generate, can be repeated (default: %s)' % op.ARCH)
+    parser.add_argument('--repodata', action='store_true',
+                        help='write repositories with primary metadata instead of indexes, '
+                             'the benchmark then includes loading them with dnf')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed, the same seed generates the same releases (default: %(default)s)')
+    parser.add_argument('--bench', type=numbers, metavar='N,N,...',
+                        help='benchmark obsolete_packages.py with these numbers of packages')
+    parser.add_argument('--bench-whatobsoletes', action='store_true',
+                        help='compare per package whatobsoletes queries with the bulk ones '
+                             'on --packages packages')
+    parser.add_argument('--bench-normalize', action='store_true',
+                        help='compare per package EVR normalizing and bumping with normalize_evrs() '
+                             'on --packages packages')
+    parser.add_argument('--workers', type=numbers, default=[1], metavar='N,N,...',
+                        help='numbers of worker processes to benchmark with (default: 1)')
+    parser.add_argument('--history', default='bench.jsonl',
+                        help='JSON lines file to append benchmark results to (default: %(default)s)')
+    args = parser.parse_args(argv)
+    args.arches = args.arches or [op.ARCH]
+    if args.releases is not None:
+        if args.releases < 2:
+            parser.error('--releases must be at least 2')
+        eol_age = op.RAWHIDEVER - op.EOL
+        op.RAWHIDEVER = op.FIRST + args.releases - 1
+        op.EOL = op.RAWHIDEVER - eol_age
+    if not (args.bench or args.bench_whatobsoletes or args.bench_normalize or args.cachedir):
+        parser.error('either a cache dir, --bench, --bench-whatobsoletes '
+                     'or --bench-normalize is required')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.bench:
+        bench(args)
+    elif args.bench_whatobsoletes:
+        bench_whatobsoletes(args)
+    elif args.bench_normalize:
+        bench_normalize(args)
+    else:
+        generate(args, args.cachedir)
+
+
+if __name__ == '__main__':
+    main()
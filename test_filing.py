@@ -0,0 +1,61 @@
+import json
+import random
+import xmlrpc.client
+
+import pytest
+
+import filing
+from filing import Journal, file_bugs, iter_json_object
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 9, 64])
+def test_iter_json_object_split_values(tmp_path, chunk_size):
+    data = {'a': 12.5, 'b': 1, 'c': -3e-2, 'd': 1E+10, 'e': 'x"y', 'f': [1, {'g': None}],
+            'h': True, 'i': False, 'j': 0}
+    path = tmp_path / 'results.json'
+    path.write_text(json.dumps(data))
+    assert dict(iter_json_object(path, chunk_size)) == data
+
+
+def test_iter_json_object_fuzz(tmp_path):
+    rng = random.Random(0)
+    path = tmp_path / 'results.json'
+    for _ in range(500):
+        data = {str(i): rng.choice([rng.random() * 10 ** rng.randint(-5, 5),
+                                    rng.randint(-1000, 1000), 'text', None, [1.5, 2]])
+                for i in range(rng.randint(0, 8))}
+        path.write_text(json.dumps(data, indent=rng.choice([None, 1])))
+        assert dict(iter_json_object(path, rng.randint(1, 16))) == data
+
+
+def test_iter_json_object_not_an_object(tmp_path):
+    path = tmp_path / 'results.json'
+    path.write_text('[1, 2]')
+    with pytest.raises(ValueError):
+        list(iter_json_object(path))
+
+
+
+class FailingBugzilla:
+    """Fails every createbug call with the same error"""
+    def __init__(self, error):
+        self.error = error
+
+    def createbug(self, createinfo):
+        raise self.error
+
+
+@pytest.mark.parametrize(('error', 'pending'), [
+    (ConnectionRefusedError(), False),
+    (xmlrpc.client.ProtocolError('fake', 429, 'Too Many Requests', {}), False),
+    (xmlrpc.client.ProtocolError('fake', 503, 'Service Unavailable', {}), False),
+    (TimeoutError(), True),  # the bug might have been created, the reply was lost
+    (ConnectionResetError(), True),
+])
+def test_file_bugs_journal_after_transient_errors(tmp_path, monkeypatch, error, pending):
+    monkeypatch.setattr(filing.time, 'sleep', lambda delay: None)
+    journal = Journal(tmp_path / 'journal.jsonl')
+    [(component, result)] = file_bugs(FailingBugzilla(error), [('foo', {'component': 'foo'})],
+                                      journal=journal)
+    assert result is error
+    assert (component in Journal(tmp_path / 'journal.jsonl').pending) is pending
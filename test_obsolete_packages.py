@@ -0,0 +1,355 @@
+import sqlite3
+from array import array
+
+import pytest
+
+import obsolete_packages
+from obsolete_packages import (INDEX_SCHEMA, Package, bump_release, covered_by_spec,
+                               dependency_graph, drop_0epoch, drop_dist, evr_compare, evr_key,
+                               index_path, load_py2_snapshot, needs_obsolete, normalize_evrs,
+                               parse_spec, py2_impact, ranges_overlap, reverse_closure, rpmvercmp,
+                               save_py2_snapshot, spec_patch)
+
+
+# The vectors of rpm's own tests/rpmvercmp.at
+RPMVERCMP = [
+    ('1.0', '1.0', 0),
+    ('1.0', '2.0', -1),
+    ('2.0', '1.0', 1),
+    ('2.0.1', '2.0.1', 0),
+    ('2.0', '2.0.1', -1),
+    ('2.0.1', '2.0', 1),
+    ('2.0.1a', '2.0.1a', 0),
+    ('2.0.1a', '2.0.1', 1),
+    ('2.0.1', '2.0.1a', -1),
+    ('5.5p1', '5.5p1', 0),
+    ('5.5p1', '5.5p2', -1),
+    ('5.5p2', '5.5p1', 1),
+    ('5.5p10', '5.5p10', 0),
+    ('5.5p1', '5.5p10', -1),
+    ('5.5p10', '5.5p1', 1),
+    ('10xyz', '10.1xyz', -1),
+    ('10.1xyz', '10xyz', 1),
+    ('xyz10', 'xyz10', 0),
+    ('xyz10', 'xyz10.1', -1),
+    ('xyz10.1', 'xyz10', 1),
+    ('xyz.4', 'xyz.4', 0),
+    ('xyz.4', '8', -1),
+    ('8', 'xyz.4', 1),
+    ('xyz.4', '2', -1),
+    ('2', 'xyz.4', 1),
+    ('5.5p2', '5.6p1', -1),
+    ('5.6p1', '5.5p2', 1),
+    ('5.6p1', '6.5p1', -1),
+    ('6.5p1', '5.6p1', 1),
+    ('6.0.rc1', '6.0', 1),
+    ('6.0', '6.0.rc1', -1),
+    ('10b2', '10a1', 1),
+    ('10a2', '10b2', -1),
+    ('1.0aa', '1.0aa', 0),
+    ('1.0a', '1.0aa', -1),
+    ('1.0aa', '1.0a', 1),
+    ('10.0001', '10.0001', 0),
+    ('10.0001', '10.1', 0),
+    ('10.1', '10.0001', 0),
+    ('10.0001', '10.0039', -1),
+    ('10.0039', '10.0001', 1),
+    ('4.999.9', '5.0', -1),
+    ('5.0', '4.999.9', 1),
+    ('20101121', '20101121', 0),
+    ('20101121', '20101122', -1),
+    ('20101122', '20101121', 1),
+    ('2_0', '2_0', 0),
+    ('2.0', '2_0', 0),
+    ('2_0', '2.0', 0),
+    ('a', 'a', 0),
+    ('a+', 'a+', 0),
+    ('a+', 'a_', 0),
+    ('a_', 'a+', 0),
+    ('+a', '+a', 0),
+    ('+a', '_a', 0),
+    ('_a', '+a', 0),
+    ('+_', '+_', 0),
+    ('_+', '+_', 0),
+    ('_+', '_', 0),
+    ('+', '_', 0),
+    ('1.0~rc1', '1.0~rc1', 0),
+    ('1.0~rc1', '1.0', -1),
+    ('1.0', '1.0~rc1', 1),
+    ('1.0~rc1', '1.0~rc2', -1),
+    ('1.0~rc2', '1.0~rc1', 1),
+    ('1.0~rc1~git123', '1.0~rc1~git123', 0),
+    ('1.0~rc1~git123', '1.0~rc1', -1),
+    ('1.0~rc1', '1.0~rc1~git123', 1),
+    ('1.0^', '1.0^', 0),
+    ('1.0^', '1.0', 1),
+    ('1.0', '1.0^', -1),
+    ('1.0^git1', '1.0^git1', 0),
+    ('1.0^git1', '1.0', 1),
+    ('1.0', '1.0^git1', -1),
+    ('1.0^git1', '1.0^git2', -1),
+    ('1.0^git2', '1.0^git1', 1),
+    ('1.0^git1', '1.01', -1),
+    ('1.01', '1.0^git1', 1),
+    ('1.0^20160101', '1.0^20160101', 0),
+    ('1.0^20160101', '1.0.1', -1),
+    ('1.0.1', '1.0^20160101', 1),
+    ('1.0^20160101^git1', '1.0^20160101^git1', 0),
+    ('1.0^20160102', '1.0^20160101^git1', 1),
+    ('1.0^20160101^git1', '1.0^20160102', -1),
+    ('1.0~rc1^git1', '1.0~rc1^git1', 0),
+    ('1.0~rc1^git1', '1.0~rc1', 1),
+    ('1.0~rc1', '1.0~rc1^git1', -1),
+    ('1.0^git1~pre', '1.0^git1~pre', 0),
+    ('1.0^git1', '1.0^git1~pre', 1),
+    ('1.0^git1~pre', '1.0^git1', -1),
+]
+
+
+@pytest.mark.parametrize(('one', 'two', 'expected'), RPMVERCMP)
+def test_rpmvercmp(one, two, expected):
+    assert rpmvercmp(one, two) == expected
+
+
+@pytest.mark.parametrize(('one', 'two', 'expected'), [
+    ('1.0-1', '1.0-1', 0),
+    ('1:1.0-1', '2.0-1', 1),
+    ('0:1.0-1', '1.0-1', 0),
+    ('1.0-2', '1.0-10', -1),
+    ('1.0', '1.0-5', 0),
+    ('1.0-1.fc31', '1.0-1.fc32', -1),
+])
+def test_evr_compare(one, two, expected):
+    assert evr_compare(one, two) == expected
+
+
+def test_evr_key_sorts_like_evr_compare():
+    evrs = ['1.0~rc1-1', '1.0-1', '1.0-1.fc31', '1.0^git1-1', '1.0.1-1', '2-0', '1:0.1-1']
+    assert sorted(reversed(evrs), key=evr_key) == evrs
+
+
+@pytest.mark.parametrize(('flags1', 'evr1', 'flags2', 'evr2', 'expected'), [
+    ('<', '1.2-3', '=', '1.2-2', True),
+    ('<', '1.2-3', '=', '1.2-3', False),
+    ('<=', '1.2', '=', '1.2-3', True),
+    ('>', '1.2', '=', '1.2-3', False),
+    ('', '', '=', '1.2-3', True),
+    ('>=', '2', '<', '2', False),
+    ('>', '1', '<', '2', True),
+])
+def test_ranges_overlap(flags1, evr1, flags2, evr2, expected):
+    assert ranges_overlap(flags1, evr1, flags2, evr2) is expected
+
+
+def scalar_normalize(evr):
+    normalized = drop_0epoch(drop_dist(evr))
+    try:
+        return normalized, bump_release(normalized)
+    except ValueError:
+        return normalized, None
+
+
+def test_normalize_evrs_matches_scalar_functions():
+    evrs = ['0:1.2-3.fc31', '1:1.2-3.fc32', '1.2-0.3.fc33', '1.2-0.0.0', '1.2-1.bbb.1.fc31',
+            '1.2-aaa.bbb.1', '1.2-1what-2what', '0:1.2-what.fc32', '1.2-fc33', '0:1.2-3.fc31']
+    assert normalize_evrs(evrs) == [scalar_normalize(evr) for evr in evrs]
+    assert normalize_evrs(iter(evrs)) == normalize_evrs(evrs)
+    assert normalize_evrs([]) == []
+
+
+FOP = Package('fedora-obsolete-packages', '33-1.fc33', 'noarch', 'fedora-obsolete-packages')
+BAR = Package('bar', '2-1.fc33', 'noarch', 'bar')
+
+
+@pytest.mark.parametrize(('rawhide', 'expected'), [
+    ([], True),
+    ([FOP], True),
+    ([BAR], False),
+    ([FOP, BAR], False),
+    ([BAR, FOP], False),
+])
+def test_needs_obsolete_in_rawhide(rawhide, expected):
+    rawhide_version = obsolete_packages.RAWHIDEVER
+    obsoleted = {version: {} for version in range(rawhide_version - 1, rawhide_version + 1)}
+    obsoleted[rawhide_version][('foo', '1-1')] = rawhide
+    assert needs_obsolete('foo', '1-1', rawhide_version - 1, obsoleted) is expected
+
+
+SPEC = """\
+Name: fedora-obsolete-packages
+Version: 33
+
+%obsolete python2-old 1.0-2
+%obsolete python2-foo 1.0-2
+
+%description
+Obsoletes packages removed from Fedora.
+"""
+
+
+@pytest.fixture
+def spec(tmp_path, monkeypatch):
+    """Write a spec file, spec_obsoletes are read from it as with --spec"""
+    def write(text=SPEC):
+        path = tmp_path / 'fedora-obsolete-packages.spec'
+        path.write_text(text)
+        monkeypatch.setattr(obsolete_packages, 'spec_obsoletes', parse_spec(path))
+        return path
+    return write
+
+
+def patched(path, obsoletes):
+    """The spec text after applying spec_patch()"""
+    old = path.read_text().splitlines(keepends=True)
+    new, pos = [], 0
+    for line in spec_patch(path, obsoletes).splitlines(keepends=True)[2:]:
+        if line.startswith('@@'):
+            start, _, count = line.split()[1][1:].partition(',')
+            start = int(start) - (count != '0')
+            new += old[pos:start]
+            pos = start
+        elif line.startswith('+'):
+            new.append(line[1:])
+        else:
+            if line.startswith(' '):
+                new.append(line[1:])
+            pos += 1
+    return ''.join(new + old[pos:])
+
+
+def test_parse_spec(spec):
+    assert parse_spec(spec()) == {'python2-old': '1.0-2', 'python2-foo': '1.0-2'}
+
+
+@pytest.mark.parametrize(('pkg', 'pkg_version', 'expected'), [
+    ('python2-foo', '1.0-1', True),  # obsoleted with exactly the bumped EVR
+    ('python2-foo', '0.9-5', True),  # obsoleted with a newer EVR
+    ('python2-foo', '1.0-2', False),
+    ('python2-foo', '1:0.1-1', False),
+    ('python2-bar', '1.0-1', False),
+    ('python2-foo', 'what', False),
+])
+def test_covered_by_spec(spec, pkg, pkg_version, expected):
+    spec()
+    [(_, bumped)] = normalize_evrs([pkg_version])
+    assert covered_by_spec(pkg, bumped) is expected
+
+
+def test_spec_patch_updates_in_place_and_appends(spec):
+    path = spec()
+    obsoletes = {29: {('python2-foo', '1.0-2'): {'x86_64'}, ('python2-new', '3-1'): {'x86_64'}}}
+    assert patched(path, obsoletes) == SPEC.replace(
+        '%obsolete python2-foo 1.0-2\n',
+        '%obsolete python2-foo 1.0-3\n'
+        '# Python 2 packages removed in Fedora 30 but never obsoleted\n'
+        '%obsolete python2-new 3-2\n')
+
+
+def test_spec_patch_nothing_to_do(spec):
+    assert spec_patch(spec(), {}) == ''
+
+
+def test_spec_patch_without_obsolete_lines(spec):
+    path = spec('Name: fedora-obsolete-packages\n\n%description\nObsoletes.\n')
+    assert patched(path, {29: {('python2-new', '3-1'): {'x86_64'}}}) == (
+        'Name: fedora-obsolete-packages\n'
+        '\n'
+        '# Python 2 packages removed in Fedora 30 but never obsoleted\n'
+        '%obsolete python2-new 3-2\n'
+        '\n'
+        '%description\n'
+        'Obsoletes.\n')
+
+
+def test_spec_patch_without_anchor(spec):
+    path = spec('Name: fedora-obsolete-packages\n')
+    with pytest.raises(ValueError):
+        spec_patch(path, {29: {('python2-new', '3-1'): {'x86_64'}}})
+
+
+@pytest.mark.parametrize(('first', 'eol', 'through'), [
+    (14, 29, 29),
+    (14, 30, 29),  # EOL raised, continue after the old one
+    (14, 28, 13),  # EOL lowered, the snapshot covers non-EOL Fedoras
+    (15, 29, 14),
+])
+def test_py2_snapshot_reuse(tmp_path, monkeypatch, first, eol, through):
+    monkeypatch.setattr(obsolete_packages, 'DNF_CACHEDIR', str(tmp_path))
+    monkeypatch.setattr(obsolete_packages, 'FIRST', 14)
+    monkeypatch.setattr(obsolete_packages, 'EOL', 29)
+    save_py2_snapshot('x86_64', 29, {'python2-foo': (20, {'1.0-1'})})
+    monkeypatch.setattr(obsolete_packages, 'FIRST', first)
+    monkeypatch.setattr(obsolete_packages, 'EOL', eol)
+    last = {'python2-foo': (20, {'1.0-1'})} if through == 29 else {}
+    assert load_py2_snapshot('x86_64') == (through, last)
+
+
+# (name, arch, source, requires, provides), every package also provides itself
+RAWHIDE = [
+    ('python2-lib', 'x86_64', 'lib', ['python(abi) = 2.7', 'python2-lib'], []),
+    ('app', 'x86_64', 'app', ['python2-lib'], []),
+    ('app-tool', 'x86_64', 'app', ['app >= 1'], []),
+    ('newlib-user', 'x86_64', 'other', ['python2-lib >= 2'], []),
+    ('selfish', 'x86_64', 'selfish', ['selfish-plugins'], ['selfish-plugins']),
+    ('python2-lib-docs', 'noarch', 'lib', ['python2-lib = 1-1.fc33'], []),
+    ('python3-lib', 'noarch', 'lib3', ['python(abi) = 3.9'], []),
+]
+
+
+@pytest.fixture
+def rawhide_index(tmp_path, monkeypatch):
+    """Write the RAWHIDE packages as the Fedora 33 x86_64 and noarch indexes"""
+    monkeypatch.setattr(obsolete_packages, 'DNF_CACHEDIR', str(tmp_path))
+    monkeypatch.setattr(obsolete_packages, 'OFFLINE', True)
+    monkeypatch.setattr(obsolete_packages, 'indexes', {})
+    (tmp_path / 'index').mkdir()
+    for arch, sign in ('x86_64', 1), ('noarch', -1):
+        db = sqlite3.connect(index_path(33, arch))
+        db.executescript(INDEX_SCHEMA)
+        pkgs = [pkg for pkg in RAWHIDE if pkg[1] == arch]
+        for i, (name, pkg_arch, source, requires, provides) in enumerate(pkgs, 1):
+            db.execute('INSERT INTO packages VALUES (?, ?, ?, ?, ?)',
+                       (sign * i, name, '1-1.fc33', pkg_arch, source))
+            deps = [('requires', *obsolete_packages.parse_reldep(dep)) for dep in requires]
+            deps += [('provides', name, '=', '1-1.fc33')]
+            deps += [('provides', dep, '', '') for dep in provides]
+            db.executemany('INSERT INTO deps VALUES (?, ?, ?, ?, ?)',
+                           ((sign * i, *dep) for dep in deps))
+        db.commit()
+        db.close()
+    yield
+    for db in obsolete_packages.indexes.values():
+        db.close()
+
+
+def edges(graph):
+    packages, offsets, requirers = graph
+    return {(packages[provider].name, packages[requirer].name)
+            for provider in range(len(packages))
+            for requirer in requirers[offsets[provider]:offsets[provider + 1]]}
+
+
+def test_dependency_graph(rawhide_index):
+    graph = dependency_graph(33, 'x86_64')
+    assert sorted(pkg.name for pkg in graph[0]) == sorted(pkg[0] for pkg in RAWHIDE)
+    # no self-provides edges, newlib-user needs a python2-lib that does not exist
+    assert edges(graph) == {('python2-lib', 'app'), ('app', 'app-tool'),
+                            ('python2-lib', 'python2-lib-docs')}
+
+
+def test_reverse_closure():
+    packages = [Package(name, '1-1', 'noarch', name) for name in 'abcde']
+    # a <- b <- c <- a (a cycle), d <- e
+    offsets = array('l', [0, 1, 2, 3, 4, 4])
+    requirers = array('l', [1, 2, 0, 4])
+    graph = packages, offsets, requirers
+    assert reverse_closure(graph, [1]) == [0, 1, 2]
+    assert reverse_closure(graph, [3]) == [3, 4]
+    assert reverse_closure(graph, []) == []
+
+
+def test_py2_impact(rawhide_index):
+    assert py2_impact(33, 'x86_64') == {
+        'app': ['app', 'app-tool'],
+        'lib': ['python2-lib', 'python2-lib-docs'],
+    }